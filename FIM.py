@@ -2,31 +2,210 @@ import os
 import logging
 import hashlib
 import time
-import openpyxl
 import shutil
-from PIL import Image
-from docx import Document
 import uuid
-from PyPDF2 import PdfFileReader
-from pptx import Presentation
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import schedule
 import threading
 from datetime import datetime
 import glob
+import atexit
+import sqlite3
+import queue
+import re
+import sys
+import argparse
+import asyncio
+import signal
+import importlib
+import subprocess
+import bisect
+import stat
+import zlib
+import lzma
+import json
+import base64
+import difflib
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def schedule_backup(target_folders, backup_location):
+# File that stores the baseline as "path|hash|event_id|size|mtime_ns|inode|ctime_ns" lines
+BASELINE_FILE = "baseline.txt"
+
+# Baseline storage backend: "text" for baseline.txt, "sqlite" for the indexed database below
+BASELINE_BACKEND = "text"
+BASELINE_DB = "baseline.db"
+
+# Flush the in-memory baseline after this many updates or this many seconds, whichever comes first
+BASELINE_FLUSH_EVENTS = 500
+BASELINE_FLUSH_INTERVAL = 30
+
+# Rehash every file on every monitoring pass instead of trusting unchanged stat signatures
+PARANOID_MODE = False
+
+# Directories to exclude from monitoring
+EXCLUDED_DIRS = ['image files']
+
+# Monitoring mode: "poll" rescans every 5 seconds, "events" reacts to watchdog events
+MONITOR_MODE = "poll"
+
+# Seconds between monitor passes in "poll" mode
+MONITOR_INTERVAL = 5
+
+# Seconds between full reconciliation scans in event-driven mode
+MONITOR_RECONCILE_INTERVAL = 300
+
+# Seconds to keep collecting events after the first one, so a create-then-write burst is checked once
+MONITOR_EVENT_SETTLE = 0.1
+
+# Backup mode: "full" copies every file, "incremental" hardlinks files unchanged since the previous snapshot,
+# "cas" stores each distinct file content once under objects/ and writes a manifest per snapshot,
+# "pack" compresses each snapshot into a single pack file under packs/
+BACKUP_MODE = "full"
+
+# Files at least this large are stored in "cas" mode as a delta against their previous version
+DELTA_MIN_SIZE = 16 * 1024 * 1024
+
+# Block size of delta signatures; each changed byte costs at most one block of backup space
+DELTA_BLOCK_SIZE = 64 * 1024
+
+# A delta carrying more new data than this fraction of the file is dropped and the file stored whole instead
+DELTA_MAX_LITERAL_RATIO = 0.5
+
+# Compression of "pack" backups: "zlib" (fast) or "lzma" (smaller)
+PACK_COMPRESSION = "zlib"
+
+# Uncompressed size of each independently compressed pack block; restoring one file decompresses only its blocks
+PACK_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Number of threads compressing pack blocks
+PACK_WORKERS = 4
+
+# Seconds between backup cycles
+BACKUP_INTERVAL = 60
+
+# Seconds a changed file must stay untouched before a change-driven backup copies it
+BACKUP_SETTLE_SECONDS = 10
+
+# Longest a path that keeps changing is held back from the backup, in seconds
+BACKUP_SETTLE_MAX_SECONDS = BACKUP_INTERVAL
+
+# Number of threads copying files during backups
+BACKUP_COPY_WORKERS = 8
+
+# Attempts at copying a file that keeps changing before it is flagged inconsistent in the snapshot
+BACKUP_COPY_RETRIES = 3
+
+# Whether backup copies are hashed and checked against the digest the monitor computed
+BACKUP_VERIFY_DIGESTS = True
+
+# Maximum rate at which backups write, in bytes per second; None copies at full speed
+BACKUP_BANDWIDTH_LIMIT = None
+
+# Snapshot retention: keep the newest snapshot of each of the last N minutes/hours/days/weeks,
+# then drop snapshots older than max_age_days and the oldest ones beyond max_total_bytes (None disables a limit)
+RETENTION_POLICY = {
+    "minutely": 5,
+    "hourly": 24,
+    "daily": 7,
+    "weekly": 4,
+    "max_age_days": None,
+    "max_total_bytes": None,
+}
+
+# Critical files, or folders of them, that are reverted to a staged copy instead of only reported
+PROTECTED_PATHS = []
+
+# Directory holding the verified copies of protected files, one file per digest
+PROTECTED_STAGE_DIR = "protected_stage"
+
+# Number of bytes read per chunk when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Persistent digest cache keyed by (device, inode, size, mtime_ns)
+HASH_CACHE_FILE = "hash_cache.txt"
+
+# Maximum number of digests kept in the hash cache; least recently used entries are evicted first
+HASH_CACHE_MAX_ENTRIES = 1000000
+
+# Number of hashing workers used by collect_baseline; 1 keeps the serial path
+BASELINE_WORKERS = 1
+
+# Worker pool type for parallel baseline collection: "process" or "thread"
+BASELINE_EXECUTOR = "process"
+
+# Per-thread read buffers reused across hash calls
+_hash_buffers = threading.local()
+
+# Callbacks invoked as callback(event_code, path, previous_path) for every 101-105 event the monitor reports
+change_listeners = []
+
+def subscribe_changes(callback):
     """
-    Schedule backup function to run every minute.
+    Registers a callback on the monitor's change stream.
+    """
+    change_listeners.append(callback)
+
+def publish_change(event_code, path, previous_path=None):
+    """
+    Passes a monitor event to every subscribed callback.
+
+    Args:
+        event_code: The event number, e.g. "103".
+        path: The path the event is about.
+        previous_path: The old path of a renamed file (104 events only).
+    """
+    for callback in list(change_listeners):
+        try:
+            callback(event_code, path, previous_path)
+        except Exception as e:
+            logger.error(f"Error in change listener for {path}: {e}")
+
+class BackupChangeTracker:
+    """
+    Dirty set of paths changed since the last backup, fed by the monitor's change stream.
+
+    Repeated edits to the same path collapse into one entry; a path is handed to the
+    backup once it has been quiet for settle seconds, or once it has been dirty for
+    max_delay seconds, so files rewritten more often than settle (logs, databases)
+    are still backed up.
     """
-    schedule.every(1).minutes.do(backup_and_manage, target_folders=target_folders, backup_location=backup_location)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+
+    def __init__(self, settle=BACKUP_SETTLE_SECONDS, max_delay=BACKUP_SETTLE_MAX_SECONDS):
+        self.settle = settle
+        self.max_delay = max_delay
+        self.dirty = {}  # path -> [time.monotonic() of the first change, of the last change]
+        self.lock = threading.Lock()
+
+    def __call__(self, event_code, path, previous_path=None):
+        now = time.monotonic()
+        with self.lock:
+            for changed_path in (path, previous_path):
+                if changed_path is not None:
+                    self.dirty.setdefault(changed_path, [now, now])[1] = now
+
+    def take(self):
+        """
+        Removes and returns the set of paths that are ready to be backed up.
+        """
+        now = time.monotonic()
+        with self.lock:
+            ready = {path for path, (first, last) in self.dirty.items() if last <= now - self.settle or first <= now - self.max_delay}
+            for path in ready:
+                del self.dirty[path]
+        return ready
+
+    def restore(self, paths):
+        """
+        Puts paths back after a failed backup so the next cycle retries them.
+        """
+        with self.lock:
+            for path in paths:
+                self.dirty.setdefault(path, [0, 0])
 
 def backup_folders(target_folders, backup_location):
     """
@@ -47,7 +226,7 @@ def backup_folders(target_folders, backup_location):
     for folder in target_folders:
         folder_name = os.path.basename(folder)
         destination = os.path.join(backup_folder, folder_name)
-        shutil.copytree(folder, destination)
+        backup_copytree(folder, destination)
 
     print("Backup completed successfully.")
 
@@ -56,49 +235,1208 @@ def backup_folders(target_folders, backup_location):
 
     return backup_folder
 
-def delete_old_backups(backup_location):
+# Snapshot folders created by backup_and_manage are named after their timestamp
+SNAPSHOT_NAME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$")
+
+def latest_snapshot(backup_location):
+    """
+    Returns the path of the most recent snapshot folder in the backup location, or None.
+    """
+    try:
+        names = [name for name in os.listdir(backup_location) if SNAPSHOT_NAME_PATTERN.match(name)]
+    except FileNotFoundError:
+        return None
+    return os.path.join(backup_location, max(names)) if names else None
+
+class BandwidthThrottle:
+    """
+    Token bucket shared by all backup copy threads, limiting their combined write rate.
+    """
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """
+        Blocks until nbytes may be written without exceeding the rate limit.
+        """
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_slot, now)
+            self.next_slot = start + nbytes / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+backup_throttle = BandwidthThrottle(BACKUP_BANDWIDTH_LIMIT)
+
+def _copy_data(fsrc, fdst, size, throttle):
+    """
+    Copies size bytes between unbuffered files, zero-copy where the kernel allows it.
+
+    Tries os.copy_file_range, then os.sendfile, and falls back to a readinto/write loop
+    through the reusable hash buffer. Each method continues from the current file
+    offsets, so a fallback part-way through is safe.
+
+    Returns:
+        The number of bytes copied.
+    """
+    source_fd = fsrc.fileno()
+    destination_fd = fdst.fileno()
+    copied = 0
+    chunk_size = HASH_CHUNK_SIZE
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while copied < size:
+                count = min(chunk_size, size - copied)
+                throttle.consume(count)
+                if method == "copy_file_range":
+                    sent = os.copy_file_range(source_fd, destination_fd, count)
+                else:
+                    sent = os.sendfile(destination_fd, source_fd, None, count)
+                if sent == 0:
+                    return copied
+                copied += sent
+            return copied
+        except OSError:
+            continue  # Not supported for this pair of files; try the next method
+    buffer = _get_hash_buffer(chunk_size)
+    view = memoryview(buffer)
+    try:
+        while True:
+            read = fsrc.readinto(buffer)
+            if not read:
+                break
+            throttle.consume(read)
+            written = 0
+            while written < read:
+                written += fdst.write(view[written:read])
+            copied += read
+    finally:
+        view.release()
+    return copied
+
+def copy_file_fast(source, destination, throttle=None):
+    """
+    Copies a file like shutil.copy2, using zero-copy kernel paths and an optional bandwidth limit.
+
+    Args:
+        source: The file to copy.
+        destination: The path to write.
+        throttle: A BandwidthThrottle; defaults to the shared backup_throttle.
+
+    Returns:
+        The number of bytes copied.
+    """
+    throttle = throttle if throttle is not None else backup_throttle
+    with open(source, "rb", buffering=0) as fsrc, open(destination, "wb", buffering=0) as fdst:
+        copied = _copy_data(fsrc, fdst, os.fstat(fsrc.fileno()).st_size, throttle)
+    shutil.copystat(source, destination)
+    return copied
+
+def copy_file_consistent(source, destination, expected=None, throttle=None, retries=BACKUP_COPY_RETRIES):
+    """
+    Copies a file and checks that the copy was not torn by a concurrent write.
+
+    The source is stat'ed before and after each attempt. If its signature moved, or the
+    copy's digest differs from the monitor's digest for the signature seen before copying,
+    the copy is retried after a short backoff. The copy's digest is returned so indexing
+    the snapshot does not hash it again; it is not put in the hash cache, which is kept
+    for the monitored files.
+
+    Args:
+        source: The file to copy.
+        destination: The path to write.
+        expected: The source's baseline info ({"hash", "signature"}), or None.
+        throttle: A BandwidthThrottle; defaults to the shared backup_throttle.
+        retries: The number of attempts.
+
+    Returns:
+        A (bytes_copied, digest, consistent) tuple; digest is the copy's digest, or None if it was not hashed.
+    """
+    for attempt in range(retries):
+        before = os.stat(source)
+        copied = copy_file_fast(source, destination, throttle)
+        after = os.stat(source)
+        digest = None
+        if file_signature(before) == file_signature(after) and copied == before.st_size:
+            if not BACKUP_VERIFY_DIGESTS:
+                return copied, None, True
+            digest = hash_file_stream(destination)
+            if expected is None or expected.get("signature") != file_signature(before) or digest == expected["hash"]:
+                return copied, digest, True
+        time.sleep(0.1 * (attempt + 1))
+    logging.warning(f"{source} kept changing while it was backed up; the copy is flagged inconsistent.")
+    return copied, digest, False
+
+def backup_copytree(source, destination, link_dest=None, changed_paths=None, workers=BACKUP_COPY_WORKERS, throttle=None, baseline=None, digests=None):
+    """
+    Copies a folder like shutil.copytree, fanning file copies out over a thread pool.
+
+    With link_dest, files that are unchanged in a previous copy are hardlinked instead.
+    A file counts as unchanged when the copy under link_dest has the same size and
+    mtime_ns (copy2 preserves mtime), the same quick check rsync --link-dest uses.
+    When the monitor's changed paths are given, every other file the monitor watches
+    is linked without being stat'ed; files it never reports (see _is_monitored) are
+    still compared by stat. The destination is always a complete tree.
+
+    Args:
+        source: The folder to copy.
+        destination: The folder to create.
+        link_dest: The same folder in the previous snapshot, or None to copy everything.
+        changed_paths: A set of source paths changed since the previous snapshot, or None to compare stats.
+        workers: The number of copy threads.
+        throttle: A BandwidthThrottle; defaults to the shared backup_throttle.
+        baseline: The BaselineStore whose digests copies are verified against, or None.
+        digests: A dictionary that receives the digest of every hashed copy, keyed by its
+            normalized destination path, or None.
+
+    Returns:
+        A (linked_files, copied_files, copied_bytes, inconsistent_paths) tuple, where
+        inconsistent_paths lists source files that changed during every copy attempt or,
+        like shutil.copytree's errors, could not be copied at all; those are left out of
+        the tree and the rest is still copied.
+    """
+    linked = copied = copied_bytes = 0
+    inconsistent = []
+    directories = []
+    pending = deque()
+    max_pending = workers * 4
+
+    def finish_copy():
+        nonlocal copied, copied_bytes
+        source_path, target_path, job = pending.popleft()
+        try:
+            size, digest, consistent = job.result()
+        except OSError as e:
+            logging.error(f"Could not back up {source_path}: {e}")
+            inconsistent.append(source_path)
+            if os.path.exists(target_path):
+                os.remove(target_path)  # Drop a partial copy
+            return
+        copied_bytes += size
+        copied += 1
+        if not consistent:
+            inconsistent.append(source_path)
+        elif digests is not None and digest is not None:
+            digests[os.path.normpath(target_path)] = digest
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for root, dirs, files in os.walk(source, followlinks=True):
+            relative_root = os.path.relpath(root, source)
+            target_root = os.path.normpath(os.path.join(destination, relative_root))
+            os.makedirs(target_root, exist_ok=True)
+            directories.append((root, target_root))
+            for f in files:
+                source_path = os.path.join(root, f)
+                target_path = os.path.join(target_root, f)
+                if link_dest is not None:
+                    previous_path = os.path.normpath(os.path.join(link_dest, relative_root, f))
+                    try:
+                        if changed_paths is not None and _is_monitored(source_path):
+                            unchanged = source_path not in changed_paths
+                        else:
+                            stat_result = os.stat(source_path)
+                            previous_stat = os.stat(previous_path)
+                            unchanged = (previous_stat.st_size, previous_stat.st_mtime_ns) == (stat_result.st_size, stat_result.st_mtime_ns)
+                        if unchanged:
+                            os.link(previous_path, target_path)
+                            linked += 1
+                            continue
+                    except OSError:
+                        pass  # No previous copy, or hardlinks unsupported here; fall back to copying
+                expected = baseline.get(source_path) if baseline is not None else None
+                pending.append((source_path, target_path, pool.submit(copy_file_consistent, source_path, target_path, expected, throttle)))
+                while len(pending) > max_pending:
+                    finish_copy()
+        while pending:
+            finish_copy()
+
+    # Copy directory metadata last, as copytree does, so file writes do not disturb it
+    for root, target_root in reversed(directories):
+        shutil.copystat(root, target_root)
+    return linked, copied, copied_bytes, inconsistent
+
+def index_manifest_path(backup_location, name):
+    """
+    Returns the path of the manifest that indexes a snapshot folder for restores.
+    """
+    return os.path.join(backup_location, "index", f"{name}.txt")
+
+def snapshot_manifest(backup_location, name, kind):
+    """
+    Returns the manifest describing a cataloged snapshot of either kind.
+    """
+    if kind == "manifest":
+        return manifest_path(backup_location, name)
+    return index_manifest_path(backup_location, name)
+
+def index_snapshot_folder(backup_location, name, target_folders, baseline=None, inconsistent=(), digests=None):
+    """
+    Writes the restore manifest of a snapshot folder, recording the digest of every copied file.
+
+    Digests of verified copies are taken from digests (see backup_copytree). Otherwise the
+    baseline digest is used when the copy still has the size and mtime the monitor
+    recorded for the source (copies keep the source mtime), and the copy is only hashed
+    when neither applies. Source paths listed in inconsistent are flagged in the manifest.
+    """
+    digests = digests or {}
+    inconsistent = {_snapshot_relative_path(path, target_folders) for path in inconsistent}
+    baseline = baseline if baseline is not None else get_baseline_store()
+    snapshot_root = os.path.join(backup_location, name)
+    folders = {os.path.basename(folder): folder for folder in target_folders}
+    entries = []
+    for entry in scan_tree(snapshot_root):
+        stat_result = entry_stat(entry)
+        relative_path = os.path.relpath(entry.path, snapshot_root)
+        folder_name, _, rest = relative_path.partition(os.sep)
+        info = baseline.get(os.path.join(folders[folder_name], rest)) if folder_name in folders else None
+        digest = digests.get(os.path.normpath(entry.path))
+        if digest is None and info and relative_path not in inconsistent and info.get("signature") and info["signature"][:2] == (stat_result.st_size, stat_result.st_mtime_ns):
+            digest = info["hash"]
+        if digest is None:
+            digest = hash_file_stream(entry.path)
+        entries.append((relative_path, digest, stat_result.st_size, stat_result.st_mtime_ns))
+    write_manifest(index_manifest_path(backup_location, name), entries, inconsistent)
+
+def object_path(backup_location, digest):
+    """
+    Returns the path of a content-addressed object, "objects/ab/cdef...", for a digest.
+    """
+    return os.path.join(backup_location, "objects", digest[:2], digest[2:])
+
+def manifest_path(backup_location, name):
+    """
+    Returns the path of the manifest of a snapshot.
+    """
+    return os.path.join(backup_location, "manifests", f"{name}.txt")
+
+def write_manifest(path, entries, inconsistent=()):
     """
-    Delete old backups from the specified location, keeping a specified number of recent backups and ensuring a maximum backup age.
+    Atomically writes a snapshot manifest.
+
+    Each line is "digest|size|mtime_ns|relative_path"; the path comes last so it may contain '|'.
+    Header lines starting with '#' record the snapshot's consistency status,
+    "#consistency|consistent" or "#consistency|inconsistent", followed by one
+    "#inconsistent|relative_path" line per file that changed while it was backed up.
+
+    Args:
+        path: The manifest path.
+        entries: An iterable of (relative_path, digest, size, mtime_ns) tuples.
+        inconsistent: The relative paths of files whose copy may be torn.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_file = f"{path}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        f.write(f"#consistency|{'inconsistent' if inconsistent else 'consistent'}\n")
+        for relative_path in sorted(inconsistent):
+            f.write(f"#inconsistent|{relative_path}\n")
+        for relative_path, digest, size, mtime_ns in entries:
+            f.write(f"{digest}|{size}|{mtime_ns}|{relative_path}\n")
+    os.replace(temp_file, path)
+
+def read_manifest(path):
+    """
+    Reads a snapshot manifest.
+
+    Returns:
+        A list of (relative_path, digest, size, mtime_ns) tuples.
+    """
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            parts = line.rstrip("\r\n").split("|", 3)
+            if len(parts) == 4:
+                entries.append((parts[3], parts[0], int(parts[1]), int(parts[2])))
+    return entries
+
+def read_manifest_inconsistencies(path):
+    """
+    Reads the consistency header of a snapshot manifest.
+
+    Returns:
+        The set of relative paths flagged inconsistent; empty for a consistent snapshot.
+    """
+    inconsistent = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            kind, _, relative_path = line.rstrip("\r\n").partition("|")
+            if kind == "#inconsistent":
+                inconsistent.add(relative_path)
+    return inconsistent
+
+def delta_path(backup_location, digest):
+    """
+    Returns the path prefix of a delta object, "deltas/ab/cdef...", for a digest.
+
+    A delta is stored as <prefix>.data, the new bytes, and <prefix>.recipe, which
+    rebuilds the file from its basis object and the data.
+    """
+    return os.path.join(backup_location, "deltas", digest[:2], digest[2:])
+
+def object_exists(backup_location, digest):
+    """
+    Returns whether the object store holds a digest, either whole or as a delta.
+    """
+    return os.path.exists(object_path(backup_location, digest)) or os.path.exists(f"{delta_path(backup_location, digest)}.recipe")
+
+def read_recipe(backup_location, digest):
+    """
+    Reads the recipe of a delta object.
+
+    Returns:
+        A (basis_digest, size, operations) tuple; operations are ("C", basis_offset, length)
+        copies from the basis and ("L", data_offset, length) copies from the delta data.
+    """
+    with open(f"{delta_path(backup_location, digest)}.recipe", "r") as f:
+        basis_digest, size = f.readline().rstrip("\r\n").split("|")
+        operations = []
+        for line in f:
+            kind, offset, length = line.rstrip("\r\n").split("|")
+            operations.append((kind, int(offset), int(length)))
+    return basis_digest, int(size), operations
+
+def block_signatures(path, block_size=DELTA_BLOCK_SIZE):
+    """
+    Computes the rsync block signatures of a file.
+
+    Returns:
+        A dictionary mapping the adler32 of each block to a list of (offset, length, sha256) tuples.
+    """
+    signatures = {}
+    offset = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            signatures.setdefault(zlib.adler32(block), []).append((offset, len(block), hashlib.sha256(block).digest()))
+            offset += len(block)
+    return signatures
+
+def _match_block(signatures, weak, block):
+    candidates = signatures.get(weak)
+    if candidates:
+        strong = hashlib.sha256(block).digest()
+        for offset, length, candidate in candidates:
+            if length == len(block) and candidate == strong:
+                return offset
+    return None
+
+def compute_delta(source_path, signatures, data_file, block_size=DELTA_BLOCK_SIZE, max_literal=None):
+    """
+    Matches a file against the block signatures of its basis, rsync style.
+
+    Blocks are first compared at their aligned offset using zlib.adler32, which costs no
+    more than hashing the file when only bytes were overwritten. After a mismatch the
+    adler32 is rolled one byte at a time over at most one block to find where the basis
+    lines up again after an insertion or deletion; if it does not, one block is stored as
+    new data and aligned matching resumes. An edit inside a block realigns by the second
+    block at the latest, so within a longer rewritten region only every 16th block is
+    rolled, bounding the pure-Python work. Unmatched bytes are appended
+    to data_file.
+
+    Args:
+        source_path: The new version of the file.
+        signatures: The block_signatures of the basis.
+        data_file: A binary file object the new data is written to.
+        block_size: The block size the signatures were computed with.
+        max_literal: Give up once this many new bytes were written.
+
+    Returns:
+        An (operations, digest, literal_bytes) tuple, or None if max_literal was exceeded.
+    """
+    operations = []
+    hasher = hashlib.sha512()
+    literal = bytearray()
+    literal_bytes = 0
+    misses = 0  # Consecutive blocks without a match
+
+    def emit(kind, offset, length):
+        if operations and operations[-1][0] == kind and operations[-1][1] + operations[-1][2] == offset:
+            operations[-1] = (kind, operations[-1][1], operations[-1][2] + length)
+        else:
+            operations.append((kind, offset, length))
+
+    def flush_literal():
+        nonlocal literal, literal_bytes
+        if literal:
+            data_file.write(literal)
+            emit("L", literal_bytes, len(literal))
+            hasher.update(literal)
+            literal_bytes += len(literal)
+            literal = bytearray()
+
+    with open(source_path, "rb") as f:
+        position = 0
+        while True:
+            f.seek(position)
+            block = f.read(block_size)
+            if not block:
+                break
+            offset = _match_block(signatures, zlib.adler32(block), block)
+            if offset is not None:
+                flush_literal()
+                emit("C", offset, len(block))
+                hasher.update(block)
+                position += len(block)
+                misses = 0
+                continue
+
+            # Roll the checksum over the next block looking for a realignment
+            window = block + f.read(block_size) if len(block) == block_size and (misses < 2 or misses % 16 == 0) else block
+            misses += 1
+            adler = zlib.adler32(block)
+            a, b = adler & 0xFFFF, adler >> 16
+            shift = None
+            for start in range(1, len(window) - block_size + 1):
+                out_byte, in_byte = window[start - 1], window[start + block_size - 1]
+                a = (a - out_byte + in_byte) % 65521
+                b = (b - block_size * out_byte + a - 1) % 65521
+                if (b << 16 | a) in signatures:
+                    offset = _match_block(signatures, b << 16 | a, window[start:start + block_size])
+                    if offset is not None:
+                        shift = start
+                        break
+            literal += window[:shift] if shift else block
+            position += shift if shift else len(block)
+            if len(literal) >= block_size:
+                flush_literal()
+            if max_literal is not None and literal_bytes + len(literal) > max_literal:
+                return None
+        flush_literal()
+    return operations, hasher.hexdigest(), literal_bytes
+
+def store_delta(backup_location, source_path, digest, stat_result, previous_digest):
+    """
+    Stores a file as a delta against the object of its previous version.
+
+    Deltas are always taken against a whole object, so restoring one never needs more
+    than one basis. If the previous version is itself a delta, its basis is used; when
+    that has drifted so far that the delta would be large, the file is stored whole and
+    becomes the basis for the following versions.
+
+    Returns:
+        A (digest, bytes_written, consistent) tuple.
+    """
+    if object_exists(backup_location, digest):
+        return digest, 0, True
+    if os.path.exists(f"{delta_path(backup_location, previous_digest)}.recipe"):
+        previous_digest = read_recipe(backup_location, previous_digest)[0]
+    basis = object_path(backup_location, previous_digest)
+    if not os.path.exists(basis):
+        return store_object(backup_location, source_path, digest, stat_result)
+
+    prefix = delta_path(backup_location, digest)
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    temp_prefix = os.path.join(os.path.dirname(prefix), f".tmp-{uuid.uuid4()}")
+    try:
+        with open(f"{temp_prefix}.data", "wb") as data_file:
+            delta = compute_delta(source_path, block_signatures(basis), data_file,
+                                  max_literal=stat_result.st_size * DELTA_MAX_LITERAL_RATIO)
+        if delta is None:
+            return store_object(backup_location, source_path, digest, stat_result)
+        operations, read_digest, literal_bytes = delta
+        consistent = file_signature(os.stat(source_path)) == file_signature(stat_result)
+        if read_digest != digest:  # The file changed after it was hashed
+            consistent = False
+            digest = read_digest
+            prefix = delta_path(backup_location, digest)
+            os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        with open(f"{temp_prefix}.recipe", "w") as f:
+            f.write(f"{previous_digest}|{sum(length for _, _, length in operations)}\n")
+            for kind, offset, length in operations:
+                f.write(f"{kind}|{offset}|{length}\n")
+        os.replace(f"{temp_prefix}.data", f"{prefix}.data")
+        os.replace(f"{temp_prefix}.recipe", f"{prefix}.recipe")  # The recipe marks the delta complete
+        if not consistent:
+            logging.warning(f"{source_path} changed while it was backed up; the delta is flagged inconsistent.")
+        return digest, literal_bytes + os.path.getsize(f"{prefix}.recipe"), consistent
+    finally:
+        for suffix in (".data", ".recipe"):
+            if os.path.exists(temp_prefix + suffix):
+                os.remove(temp_prefix + suffix)
+
+def materialize_object(backup_location, digest, destination):
+    """
+    Writes the content of a stored object, whole or delta, to destination.
+    """
+    if os.path.exists(object_path(backup_location, digest)):
+        copy_file_fast(object_path(backup_location, digest), destination)
+        return
+    basis_digest, _, operations = read_recipe(backup_location, digest)
+    with open(object_path(backup_location, basis_digest), "rb") as basis, \
+            open(f"{delta_path(backup_location, digest)}.data", "rb") as data, \
+            open(destination, "wb") as out:
+        for kind, offset, length in operations:
+            source = basis if kind == "C" else data
+            source.seek(offset)
+            while length:
+                chunk = source.read(min(length, HASH_CHUNK_SIZE))
+                out.write(chunk)
+                length -= len(chunk)
+
+def store_object(backup_location, source_path, digest, stat_result):
+    """
+    Copies a file into the object store unless an object with its digest already exists.
+
+    The copy is checked with copy_file_consistent against the digest the file was looked
+    up by. If the file kept changing, the copy is stored under the digest of what was
+    actually read and reported inconsistent.
+
+    Returns:
+        A (digest, bytes_written, consistent) tuple.
+    """
+    destination = object_path(backup_location, digest)
+    if object_exists(backup_location, digest):
+        return digest, 0, True
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temp_file = os.path.join(os.path.dirname(destination), f".tmp-{uuid.uuid4()}")
+    expected = {"hash": digest, "signature": file_signature(stat_result)}
+    written, copy_digest, consistent = copy_file_consistent(source_path, temp_file, expected)
+    if copy_digest is None:
+        copy_digest = hash_file_stream(temp_file)
+    if copy_digest != digest:
+        digest = copy_digest
+        destination = object_path(backup_location, digest)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(temp_file, destination)
+    return digest, written, consistent
+
+def snapshot_digest(full_path, stat_result, baseline=None):
+    """
+    Returns the digest of a file, taken from the baseline when its stat signature still matches.
+    """
+    baseline = baseline if baseline is not None else get_baseline_store()
+    info = baseline.get(full_path)
+    if info is not None and info.get("signature") == file_signature(stat_result):
+        return info["hash"]
+    return calculate_file_hash(full_path, stat_result=stat_result)
+
+def latest_manifest(backup_location):
+    """
+    Returns the path of the most recent snapshot manifest in the backup location, or None.
+    """
+    names = [
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(backup_location, "manifests", "*.txt"))
+    ]
+    names = [name for name in names if SNAPSHOT_NAME_PATTERN.match(name)]
+    return manifest_path(backup_location, max(names)) if names else None
+
+def _snapshot_relative_path(full_path, target_folders):
+    """
+    Returns the path of a file inside a snapshot ("folder_name/relative/path"), or None if it is outside the target folders.
+    """
+    for folder in target_folders:
+        prefix = os.path.join(folder, "")
+        if full_path.startswith(prefix):
+            return os.path.join(os.path.basename(folder), full_path[len(prefix):])
+    return None
+
+def cas_snapshot(target_folders, backup_location, name, baseline=None, changed_paths=None, previous_manifest=None):
+    """
+    Creates a content-addressed snapshot: new contents go to objects/, the snapshot itself is a manifest.
+
+    Digests already computed by the monitor are reused, so unchanged and duplicate files
+    are neither hashed nor copied again. When changed_paths and previous_manifest are
+    given, entries of the previous manifest are carried over without a stat for files
+    the monitor watches and did not report; files it never reports (see _is_monitored)
+    are carried over only if their size and mtime are unchanged.
+    Changed files of at least DELTA_MIN_SIZE are stored as a delta against their
+    version in previous_manifest.
+
+    Returns:
+        A (files, new_objects, bytes_written, inconsistent_paths) tuple.
+    """
+    new_objects = bytes_written = 0
+    inconsistent = set()
+    previous_entries = {entry[0]: entry for entry in read_manifest(previous_manifest)} if previous_manifest else {}
+
+    def add(full_path, relative_path, stat_result):
+        nonlocal new_objects, bytes_written
+        digest = snapshot_digest(full_path, stat_result, baseline)
+        previous = previous_entries.get(relative_path)
+        if previous and previous[1] != digest and stat_result.st_size >= DELTA_MIN_SIZE:
+            digest, written, consistent = store_delta(backup_location, full_path, digest, stat_result, previous[1])
+        else:
+            digest, written, consistent = store_object(backup_location, full_path, digest, stat_result)
+        if not consistent:
+            inconsistent.add(relative_path)
+        if written:
+            new_objects += 1
+            bytes_written += written
+        entries[relative_path] = (relative_path, digest, stat_result.st_size, stat_result.st_mtime_ns)
+
+    if changed_paths is not None and previous_manifest is not None:
+        entries = {}
+        previous_inconsistent = read_manifest_inconsistencies(previous_manifest)
+        for folder in target_folders:
+            folder_name = os.path.basename(folder)
+            for entry in scan_tree(folder):
+                relative_path = os.path.join(folder_name, os.path.relpath(entry.path, folder))
+                previous = previous_entries.get(relative_path)
+                monitored = _is_monitored(entry.path)
+                if previous is not None and monitored and entry.path not in changed_paths:
+                    unchanged = True
+                else:
+                    stat_result = entry_stat(entry)
+                    unchanged = previous is not None and not monitored and (previous[2], previous[3]) == (stat_result.st_size, stat_result.st_mtime_ns)
+                if unchanged:
+                    entries[relative_path] = previous
+                    if relative_path in previous_inconsistent:
+                        inconsistent.add(relative_path)
+                else:
+                    add(entry.path, relative_path, stat_result)
+    else:
+        entries = {}
+        for folder in target_folders:
+            folder_name = os.path.basename(folder)
+            for entry in scan_tree(folder):
+                add(entry.path, os.path.join(folder_name, os.path.relpath(entry.path, folder)), entry_stat(entry))
+
+    write_manifest(manifest_path(backup_location, name), entries.values(), inconsistent)
+    return len(entries), new_objects, bytes_written, inconsistent
+
+def collect_garbage(backup_location):
+    """
+    Deletes objects and deltas that are no longer referenced by any manifest.
+
+    Whole objects that still serve as the basis of a referenced delta are kept.
+
+    Returns:
+        The number of deleted objects.
+    """
+    referenced = set()
+    for path in glob.glob(os.path.join(backup_location, "manifests", "*.txt")):
+        referenced.update(digest for _, digest, _, _ in read_manifest(path))
+    deleted = 0
+    for entry in scan_tree(os.path.join(backup_location, "deltas")):
+        digest, extension = os.path.splitext(os.path.basename(os.path.dirname(entry.path)) + entry.name)
+        if digest not in referenced:
+            os.remove(entry.path)
+            deleted += extension == ".recipe"
+        elif extension == ".recipe":
+            referenced.add(read_recipe(backup_location, digest)[0])
+    for entry in scan_tree(os.path.join(backup_location, "objects")):
+        digest = os.path.basename(os.path.dirname(entry.path)) + entry.name
+        if digest not in referenced:
+            os.remove(entry.path)
+            deleted += 1
+    return deleted
+
+def pack_path(backup_location, name):
+    """
+    Returns the path of the pack file of a "pack" snapshot.
+    """
+    return os.path.join(backup_location, "packs", f"{name}.pack")
+
+def pack_index_path(backup_location, name):
+    """
+    Returns the path of the index that locates each file inside a pack.
+    """
+    return os.path.join(backup_location, "packs", f"{name}.idx")
+
+def latest_pack(backup_location):
+    """
+    Returns the path of the most recent pack in the backup location, or None.
+    """
+    names = [
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(backup_location, "packs", "*.pack"))
+    ]
+    names = [name for name in names if SNAPSHOT_NAME_PATTERN.match(name)]
+    return pack_path(backup_location, max(names)) if names else None
+
+# Block compressors and decompressors by PACK_COMPRESSION name
+_pack_codecs = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+def write_pack(files, pack_file, index_file, codec=None, block_size=PACK_BLOCK_SIZE, workers=PACK_WORKERS):
+    """
+    Packs files into one compressed archive with a seekable index.
+
+    File contents are concatenated into a single stream that is cut into blocks of
+    block_size bytes. Each block is compressed on its own by a worker thread (zlib and
+    lzma release the GIL), and the blocks are written in order. The index records where each
+    block starts in the stream and in the pack, and where each file starts in the stream,
+    so one file can be extracted by decompressing only the blocks it spans.
+
+    Args:
+        files: An iterable of (full_path, relative_path) tuples.
+        pack_file: The pack to write.
+        index_file: The index to write.
+        codec: "zlib" or "lzma"; defaults to PACK_COMPRESSION.
+        block_size: The uncompressed size of a block.
+        workers: The number of compression threads.
+
+    A file whose signature moved while it was read cannot be re-read into the stream,
+    so it is only reported inconsistent.
+
+    Returns:
+        A (manifest_entries, raw_bytes, packed_bytes, inconsistent_paths) tuple, where
+        manifest_entries are (relative_path, digest, size, mtime_ns) tuples for write_manifest.
+    """
+    codec = codec or PACK_COMPRESSION
+    compress = _pack_codecs[codec][0]
+    os.makedirs(os.path.dirname(pack_file), exist_ok=True)
+    blocks = []  # (stream_offset, pack_offset, packed_length)
+    members = []  # (relative_path, digest, size, mtime_ns, stream_offset)
+    inconsistent = []
+    pending = deque()  # (future, stream_offset) in stream order
+    block = bytearray()
+    stream_offset = block_start = pack_offset = 0
+
+    with open(f"{pack_file}.tmp", "wb") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        def write_oldest():
+            nonlocal pack_offset
+            future, start = pending.popleft()
+            data = future.result()
+            out.write(data)
+            blocks.append((start, pack_offset, len(data)))
+            pack_offset += len(data)
+
+        def cut_block():
+            nonlocal block, block_start
+            pending.append((pool.submit(compress, bytes(block)), block_start))
+            block_start += len(block)
+            block = bytearray()
+            while len(pending) > workers * 2:  # Bound the memory held by queued blocks
+                write_oldest()
+
+        for full_path, relative_path in files:
+            hasher = hashlib.sha512()
+            start = stream_offset
+            try:
+                with open(full_path, "rb") as f:
+                    stat_result = os.fstat(f.fileno())
+                    while True:
+                        data = f.read(min(HASH_CHUNK_SIZE, block_size - len(block)))
+                        if not data:
+                            break
+                        hasher.update(data)
+                        block += data
+                        stream_offset += len(data)
+                        if len(block) >= block_size:
+                            cut_block()
+                    if file_signature(os.stat(full_path)) != file_signature(stat_result) or stream_offset - start != stat_result.st_size:
+                        logging.warning(f"{full_path} changed while it was packed; it is flagged inconsistent.")
+                        inconsistent.append(relative_path)
+            except OSError as e:
+                logging.warning(f"Skipped {full_path} while packing: {e}")
+                continue  # Bytes already read stay in the stream unreferenced
+            members.append((relative_path, hasher.hexdigest(), stream_offset - start, stat_result.st_mtime_ns, start))
+        if block:
+            cut_block()
+        while pending:
+            write_oldest()
+
+    temp_file = f"{index_file}.tmp"
+    with open(temp_file, "w") as f:
+        f.write(f"{codec}|{block_size}\n")
+        for start, offset, length in blocks:
+            f.write(f"B|{start}|{offset}|{length}\n")
+        for relative_path, digest, size, mtime_ns, start in members:
+            f.write(f"F|{digest}|{size}|{mtime_ns}|{start}|{relative_path}\n")
+    os.replace(f"{pack_file}.tmp", pack_file)
+    os.replace(temp_file, index_file)
+    return [member[:4] for member in members], stream_offset, pack_offset, inconsistent
+
+class PackReader:
+    """
+    Extracts single files from a pack using its index.
+
+    Recently decompressed blocks are kept, so restoring many small files that share a
+    block decompresses it once.
+    """
+
+    def __init__(self, pack_file, index_file, cached_blocks=8):
+        self.pack_file = pack_file
+        self.members = {}  # relative path -> (digest, size, mtime_ns, stream_offset)
+        self.block_starts = []
+        self.blocks = []  # (pack_offset, packed_length)
+        with open(index_file, "r") as f:
+            codec, _ = f.readline().rstrip("\r\n").split("|")
+            for line in f:
+                parts = line.rstrip("\r\n").split("|", 5)
+                if parts[0] == "B":
+                    self.block_starts.append(int(parts[1]))
+                    self.blocks.append((int(parts[2]), int(parts[3])))
+                elif parts[0] == "F":
+                    self.members[parts[5]] = (parts[1], int(parts[2]), int(parts[3]), int(parts[4]))
+        self.decompress = _pack_codecs[codec][1]
+        self.cache = OrderedDict()
+        self.cached_blocks = cached_blocks
+        self.lock = threading.Lock()
+
+    def _block(self, number):
+        with self.lock:
+            if number in self.cache:
+                self.cache.move_to_end(number)
+                return self.cache[number]
+        offset, length = self.blocks[number]
+        with open(self.pack_file, "rb") as f:
+            f.seek(offset)
+            data = self.decompress(f.read(length))
+        with self.lock:
+            self.cache[number] = data
+            if len(self.cache) > self.cached_blocks:
+                self.cache.popitem(last=False)
+        return data
+
+    def read(self, relative_path):
+        """
+        Yields the contents of one packed file, block by block.
+        """
+        _, size, _, start = self.members[relative_path]
+        number = bisect.bisect_right(self.block_starts, start) - 1
+        end = start + size
+        position = start
+        while position < end:
+            data = self._block(number)
+            block_start = self.block_starts[number]
+            yield data[position - block_start:end - block_start]
+            position = block_start + len(data)
+            number += 1
+
+    def extract(self, relative_path, destination):
+        """
+        Writes one packed file to destination.
+        """
+        with open(destination, "wb") as f:
+            for data in self.read(relative_path):
+                f.write(data)
+
+# PackReaders by pack path, so restores reuse parsed indexes and decompressed blocks
+_pack_readers = {}
+
+def get_pack_reader(backup_location, name):
+    """
+    Returns the PackReader of a pack snapshot.
+    """
+    path = pack_path(backup_location, name)
+    if path not in _pack_readers:
+        _pack_readers[path] = PackReader(path, pack_index_path(backup_location, name))
+    return _pack_readers[path]
+
+def pack_snapshot(target_folders, backup_location, name):
+    """
+    Creates a "pack" snapshot: every file of the target folders compressed into one pack.
+
+    Returns:
+        A (files, raw_bytes, packed_bytes, inconsistent_paths) tuple.
+    """
+    def files():
+        for folder in target_folders:
+            folder_name = os.path.basename(folder)
+            for entry in scan_tree(folder):
+                yield entry.path, os.path.join(folder_name, os.path.relpath(entry.path, folder))
+
+    entries, raw_bytes, packed_bytes, inconsistent = write_pack(files(), pack_path(backup_location, name), pack_index_path(backup_location, name))
+    write_manifest(index_manifest_path(backup_location, name), entries, inconsistent)
+    return len(entries), raw_bytes, packed_bytes, inconsistent
+
+def catalog_path(backup_location):
+    """
+    Returns the path of the snapshot catalog, "catalog.txt", of a backup location.
+    """
+    return os.path.join(backup_location, "catalog.txt")
+
+_catalog_lock = threading.Lock()
+
+def _snapshot_location(backup_location, name, kind):
+    """
+    Returns the folder or manifest that holds a cataloged snapshot.
+    """
+    if kind == "manifest":
+        return manifest_path(backup_location, name)
+    if kind == "pack":
+        return pack_path(backup_location, name)
+    return os.path.join(backup_location, name)
+
+def snapshot_created(name):
+    """
+    Returns the POSIX timestamp encoded in a snapshot name such as "2024-06-20_11-24-26".
+    """
+    return datetime.strptime(name, "%Y-%m-%d_%H-%M-%S").timestamp()
+
+def load_catalog(backup_location):
+    """
+    Loads the snapshot catalog, rebuilding it from the snapshot names if it does not exist yet.
+
+    Returns:
+        A list of {"name", "kind", "created", "size"} dictionaries, oldest first; empty if
+        the backup location does not exist yet.
+    """
+    path = catalog_path(backup_location)
+    snapshots = []
+    if not os.path.isdir(backup_location):
+        return snapshots
+    with _catalog_lock:
+        if not os.path.exists(path):
+            # Catalog snapshots created before the catalog existed; their sizes are unknown
+            existing = [(name, "folder") for name in os.listdir(backup_location) if SNAPSHOT_NAME_PATTERN.match(name)]
+            existing += [
+                (os.path.splitext(os.path.basename(manifest))[0], "manifest")
+                for manifest in glob.glob(os.path.join(backup_location, "manifests", "*.txt"))
+            ]
+            existing += [
+                (os.path.splitext(os.path.basename(pack))[0], "pack")
+                for pack in glob.glob(os.path.join(backup_location, "packs", "*.pack"))
+            ]
+            with open(path, "w") as f:
+                for name, kind in existing:
+                    if SNAPSHOT_NAME_PATTERN.match(name):
+                        f.write(f"{name}|{kind}|{snapshot_created(name)}|0\n")
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.rstrip("\r\n").split("|")
+                if len(parts) == 4:
+                    snapshots.append({"name": parts[0], "kind": parts[1], "created": float(parts[2]), "size": int(parts[3])})
+    snapshots.sort(key=lambda snapshot: snapshot["created"])
+    return snapshots
+
+def record_snapshot(backup_location, name, kind, size):
+    """
+    Appends a new snapshot to the catalog.
+
+    The snapshot is cataloged at the time its name encodes, i.e. when it was started, so
+    restoring "at" a snapshot name finds that snapshot rather than the one before it.
 
     Args:
         backup_location: The path to the location where backups are stored.
+        name: The snapshot timestamp name.
+        kind: "folder" for a snapshot folder, "manifest" for a content-addressed snapshot, "pack" for a pack.
+        size: The number of bytes the snapshot added to the backup location.
+    """
+    snapshots = load_catalog(backup_location)  # Make sure older snapshots are cataloged first
+    if any(snapshot["name"] == name for snapshot in snapshots):
+        # A freshly rebuilt catalog already picked this snapshot up from disk
+        _save_catalog(backup_location, [snapshot for snapshot in snapshots if snapshot["name"] != name])
+    with _catalog_lock:
+        with open(catalog_path(backup_location), "a") as f:
+            f.write(f"{name}|{kind}|{snapshot_created(name)}|{size}\n")
+
+def _save_catalog(backup_location, snapshots):
+    with _catalog_lock:
+        temp_file = f"{catalog_path(backup_location)}.tmp"
+        with open(temp_file, "w") as f:
+            for snapshot in snapshots:
+                f.write(f"{snapshot['name']}|{snapshot['kind']}|{snapshot['created']}|{snapshot['size']}\n")
+        os.replace(temp_file, catalog_path(backup_location))
+
+def select_expired_snapshots(snapshots, policy, now=None):
+    """
+    Applies a GFS-style retention policy to a list of cataloged snapshots.
+
+    The newest snapshot is always kept. Within each tier the newest snapshot of each of the
+    last N minutes, hours, days or ISO weeks is kept; max_age_days and max_total_bytes then
+    drop the oldest of the remaining snapshots.
+
+    Returns:
+        The snapshots to delete.
+    """
+    if not snapshots:
+        return []
+    now = time.time() if now is None else now
+    newest_first = sorted(snapshots, key=lambda snapshot: snapshot["created"], reverse=True)
+    tiers = {
+        "minutely": lambda created: created.strftime("%Y-%m-%d %H:%M"),
+        "hourly": lambda created: created.strftime("%Y-%m-%d %H"),
+        "daily": lambda created: created.strftime("%Y-%m-%d"),
+        "weekly": lambda created: created.isocalendar()[:2],
+    }
+
+    kept = {newest_first[0]["name"]}
+    for tier, bucket_of in tiers.items():
+        limit = policy.get(tier) or 0
+        buckets = set()
+        for snapshot in newest_first:
+            if len(buckets) >= limit:
+                break
+            bucket = bucket_of(datetime.fromtimestamp(snapshot["created"]))
+            if bucket not in buckets:
+                buckets.add(bucket)
+                kept.add(snapshot["name"])
+
+    retained = [snapshot for snapshot in newest_first if snapshot["name"] in kept]
+    if policy.get("max_age_days") is not None:
+        cutoff = now - policy["max_age_days"] * 86400
+        retained = retained[:1] + [snapshot for snapshot in retained[1:] if snapshot["created"] >= cutoff]
+    if policy.get("max_total_bytes") is not None:
+        total = sum(snapshot["size"] for snapshot in retained)
+        while len(retained) > 1 and total > policy["max_total_bytes"]:
+            total -= retained.pop()["size"]
+
+    retained_names = {snapshot["name"] for snapshot in retained}
+    return [snapshot for snapshot in snapshots if snapshot["name"] not in retained_names]
+
+_deletion_queue = queue.Queue()
+_deletion_thread = None
+
+def _deletion_worker():
     """
-    # Get a list of all backup folders
-    backups = glob.glob(os.path.join(backup_location, "*"))
-    backups.sort(key=os.path.getctime)
+    Deletes expired snapshots queued by delete_old_backups, off the backup path.
+    """
+    while True:
+        backup_location, expired = _deletion_queue.get()
+        try:
+            for snapshot in expired:
+                location = _snapshot_location(backup_location, snapshot["name"], snapshot["kind"])
+                if os.path.isdir(location):
+                    shutil.rmtree(location)
+                elif os.path.exists(location):
+                    os.remove(location)
+                if snapshot["kind"] == "pack":
+                    _pack_readers.pop(location, None)
+                    if os.path.exists(pack_index_path(backup_location, snapshot["name"])):
+                        os.remove(pack_index_path(backup_location, snapshot["name"]))
+                if snapshot["kind"] in ("folder", "pack") and os.path.exists(index_manifest_path(backup_location, snapshot["name"])):
+                    os.remove(index_manifest_path(backup_location, snapshot["name"]))
+                logging.info(f"Deleted old backup: {location}")
+            if any(snapshot["kind"] == "manifest" for snapshot in expired):
+                collect_garbage(backup_location)
+        except Exception as e:
+            logging.exception("An error occurred while deleting old backups: %s", e)
+        finally:
+            _deletion_queue.task_done()
+
+def delete_old_backups(backup_location, policy=None, wait=False):
+    """
+    Delete old backups from the specified location according to the retention policy.
 
-    # Delete oldest backup if there are more than 2 backups
-    if len(backups) > 2:
-        oldest_backup = backups[0]
-        shutil.rmtree(oldest_backup)
-        logging.info(f"Deleted old backup: {oldest_backup}")
+    Expired snapshots are chosen from the catalog, removed from it immediately and deleted
+    by a background thread, so a backlog is cleared in one pass without delaying backups.
+
+    Args:
+        backup_location: The path to the location where backups are stored.
+        policy: A retention policy dictionary; defaults to RETENTION_POLICY.
+        wait: If True, block until the deletions have finished.
 
+    Returns:
+        The expired snapshots.
+    """
+    global _deletion_thread
+    snapshots = load_catalog(backup_location)
+    expired = select_expired_snapshots(snapshots, policy or RETENTION_POLICY)
+    if expired:
+        expired_names = {snapshot["name"] for snapshot in expired}
+        _save_catalog(backup_location, [snapshot for snapshot in snapshots if snapshot["name"] not in expired_names])
+        if _deletion_thread is None or not _deletion_thread.is_alive():
+            _deletion_thread = threading.Thread(target=_deletion_worker, daemon=True)
+            _deletion_thread.start()
+        _deletion_queue.put((backup_location, expired))
+    if wait:
+        _deletion_queue.join()
+    return expired
+
+def backup_and_manage(target_folders, backup_location, mode=None, tracker=None, manage_retention=True):
+    """
+    Function to backup folders, delete old backups, and manage backups periodically.
 
-def backup_and_manage(target_folders, backup_location):
-    """ Function to backup folders, delete old backups, and manage backups periodically. """
+    Args:
+        target_folders: A list of paths to the target folders.
+        backup_location: The path to the location where backups will be stored.
+        mode: "full", "incremental", "cas" or "pack"; defaults to BACKUP_MODE.
+        tracker: A BackupChangeTracker fed by the monitor. If given, the cycle is skipped when
+            nothing changed, and incremental/cas snapshots only copy the changed paths.
+        manage_retention: If False, old backups are left for the caller to delete.
+    """
+    mode = mode or BACKUP_MODE
+    changed_paths = None
     try:
         # Backup the folders
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         backup_folder = os.path.join(backup_location, timestamp)
 
+        if mode == "cas":
+            previous_snapshot = latest_manifest(backup_location)
+        elif mode == "pack":
+            previous_snapshot = latest_pack(backup_location)
+        else:
+            previous_snapshot = latest_snapshot(backup_location)
+        if tracker is not None:
+            changed_paths = tracker.take()
+            if previous_snapshot is None:
+                changed_paths = None  # The first snapshot has to cover everything
+            elif not changed_paths:
+                logging.debug("No changes since the last backup, skipping backup cycle.")
+                return
+
+        if mode == "cas":
+            if not os.path.exists(manifest_path(backup_location, timestamp)):
+                files, new_objects, bytes_written, inconsistent = cas_snapshot(
+                    target_folders, backup_location, timestamp, changed_paths=changed_paths, previous_manifest=previous_snapshot
+                )
+                record_snapshot(backup_location, timestamp, "manifest", bytes_written)
+                print("Backup completed successfully.")
+                logging.info(f"Backup created at: {manifest_path(backup_location, timestamp)} "
+                             f"({files} files, {new_objects} new objects, {bytes_written} bytes written, {len(inconsistent)} inconsistent)")
+                if manage_retention:
+                    delete_old_backups(backup_location)
+            return
+
+        if mode == "pack":
+            if not os.path.exists(pack_path(backup_location, timestamp)):
+                files, raw_bytes, packed_bytes, inconsistent = pack_snapshot(target_folders, backup_location, timestamp)
+                record_snapshot(backup_location, timestamp, "pack", packed_bytes)
+                print("Backup completed successfully.")
+                logging.info(f"Backup created at: {pack_path(backup_location, timestamp)} "
+                             f"({files} files, {raw_bytes} bytes packed into {packed_bytes}, {len(inconsistent)} inconsistent)")
+                if manage_retention:
+                    delete_old_backups(backup_location)
+            return
+
         # Check if the backup folder already exists
         if not os.path.exists(backup_folder):
             # Create the backup folder
             os.makedirs(backup_folder)
 
             # Copy files from target folders to the backup folder
-            for folder in target_folders:
-                folder_name = os.path.basename(folder)
-                destination = os.path.join(backup_folder, folder_name)
-                shutil.copytree(folder, destination)
+            snapshot_bytes = 0
+            inconsistent = []
+            baseline = get_baseline_store()
+            digests = {}
+            try:
+                for folder in target_folders:
+                    folder_name = os.path.basename(folder)
+                    destination = os.path.join(backup_folder, folder_name)
+                    if mode == "incremental":
+                        link_dest = os.path.join(previous_snapshot, folder_name) if previous_snapshot else None
+                        linked, copied, copied_bytes, torn = backup_copytree(folder, destination, link_dest, changed_paths, baseline=baseline, digests=digests)
+                        logging.info(f"Incremental backup of {folder}: {linked} files linked, {copied} files ({copied_bytes} bytes) copied")
+                    else:
+                        linked, copied, copied_bytes, torn = backup_copytree(folder, destination, baseline=baseline, digests=digests)
+                    snapshot_bytes += copied_bytes
+                    inconsistent += torn
+                index_snapshot_folder(backup_location, timestamp, target_folders, baseline, inconsistent, digests)
+                record_snapshot(backup_location, timestamp, "folder", snapshot_bytes)
+            except BaseException:
+                # An uncataloged folder would never be picked up by retention, so drop the partial snapshot
+                shutil.rmtree(backup_folder, ignore_errors=True)
+                if os.path.exists(index_manifest_path(backup_location, timestamp)):
+                    os.remove(index_manifest_path(backup_location, timestamp))
+                raise
 
             print("Backup completed successfully.")
 
             # Log backup creation
-            logging.info(f"Backup created at: {backup_folder}")
+            logging.info(f"Backup created at: {backup_folder} ({len(inconsistent)} inconsistent files)")
 
             # Delete old backups
-            delete_old_backups(backup_location)
+            if manage_retention:
+                delete_old_backups(backup_location)
         else:
             # Log a message indicating that the backup folder already exists
             pass
@@ -109,291 +1447,1103 @@ def backup_and_manage(target_folders, backup_location):
 
     except Exception as e:
         logging.exception("An error occurred in backup_and_manage function: %s", e)
+        if tracker is not None and changed_paths:
+            tracker.restore(changed_paths)
+
+
+class RestoreIndex:
+    """
+    Index of which snapshot holds which version of each backed-up path.
+
+    Built by replaying the snapshot manifests in catalog order and recording only the
+    changes between consecutive snapshots, so memory grows with the number of versions
+    rather than snapshots times files. A lookup bisects the version times of one path;
+    a subtree lookup bisects the sorted path list for its prefix.
+    """
+
+    def __init__(self, backup_location):
+        self.backup_location = backup_location
+        self.versions = {}  # relative path -> ([created, ...], [version or None if deleted, ...])
+        self.sorted_paths = []
+        self.snapshot_names = []
+        self.previous = {}
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Indexes snapshots added to the catalog since the last refresh, rebuilding if any were deleted.
+        """
+        with self.lock:
+            catalog = load_catalog(self.backup_location)
+            names = [snapshot["name"] for snapshot in catalog]
+            if names[:len(self.snapshot_names)] != self.snapshot_names:
+                self.versions = {}
+                self.snapshot_names = []
+                self.previous = {}
+            for snapshot in catalog[len(self.snapshot_names):]:
+                self._add_snapshot(snapshot)
+                self.snapshot_names.append(snapshot["name"])
+            self.sorted_paths = sorted(self.versions)
+
+    def _add_snapshot(self, snapshot):
+        path = snapshot_manifest(self.backup_location, snapshot["name"], snapshot["kind"])
+        if not os.path.exists(path):
+            logging.warning(f"Snapshot {snapshot['name']} has no manifest and cannot be restored from.")
+            return
+        current = {}
+        inconsistent = read_manifest_inconsistencies(path)
+        for relative_path, digest, size, mtime_ns in read_manifest(path):
+            current[relative_path] = (digest, size, mtime_ns, relative_path not in inconsistent)
+            if self.previous.get(relative_path) != current[relative_path]:
+                version = {"snapshot": snapshot["name"], "kind": snapshot["kind"], "path": relative_path,
+                           "digest": digest, "size": size, "mtime_ns": mtime_ns,
+                           "consistent": relative_path not in inconsistent}
+                self._append(relative_path, snapshot["created"], version)
+        for relative_path in self.previous.keys() - current.keys():
+            self._append(relative_path, snapshot["created"], None)
+        self.previous = current
+
+    def _append(self, relative_path, created, version):
+        times, versions = self.versions.setdefault(relative_path, ([], []))
+        times.append(created)
+        versions.append(version)
+
+    def lookup(self, relative_path, when):
+        """
+        Returns the version of a path as of a point in time, or None if it did not exist then.
+        """
+        entry = self.versions.get(relative_path)
+        if entry is None:
+            return None
+        position = bisect.bisect_right(entry[0], when) - 1
+        return entry[1][position] if position >= 0 else None
+
+    def lookup_tree(self, relative_path, when):
+        """
+        Returns the versions, as of a point in time, of a path or of every path below it.
+        """
+        if relative_path in self.versions:
+            version = self.lookup(relative_path, when)
+            return [version] if version else []
+        prefix = os.path.join(relative_path, "")
+        found = []
+        for position in range(bisect.bisect_left(self.sorted_paths, prefix), len(self.sorted_paths)):
+            path = self.sorted_paths[position]
+            if not path.startswith(prefix):
+                break
+            version = self.lookup(path, when)
+            if version:
+                found.append(version)
+        return found
+
+_restore_indexes = {}
+
+def get_restore_index(backup_location):
+    """
+    Returns the RestoreIndex of a backup location, refreshed with any new snapshots.
+    """
+    index = _restore_indexes.setdefault(backup_location, RestoreIndex(backup_location))
+    index.refresh()
+    return index
+
+def restore_file(backup_location, version, destination):
+    """
+    Restores one file version atomically and verifies it against its recorded digest.
+
+    The copy is written next to the destination and only renamed over it if its digest matches.
+
+    Returns:
+        True if the restored file matched its digest, False if it was discarded.
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    temp_file = os.path.join(os.path.dirname(destination), f".{os.path.basename(destination)}.restore-{uuid.uuid4()}")
+    try:
+        if version["kind"] == "pack":
+            get_pack_reader(backup_location, version["snapshot"]).extract(version["path"], temp_file)
+        elif version["kind"] == "manifest":
+            materialize_object(backup_location, version["digest"], temp_file)
+        else:
+            copy_file_fast(os.path.join(backup_location, version["snapshot"], version["path"]), temp_file)
+        if hash_file_stream(temp_file) != version["digest"]:
+            logging.error(f"Restored copy of {destination} does not match digest {version['digest']}; discarded.")
+            return False
+        if not version["consistent"]:
+            logging.warning(f"{destination} is restored from a copy flagged inconsistent in snapshot {version['snapshot']}.")
+        os.utime(temp_file, ns=(version["mtime_ns"], version["mtime_ns"]))
+        os.replace(temp_file, destination)
+        return True
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def parse_restore_time(value):
+    """
+    Parses a restore time given as ISO 8601 ("2024-06-20 11:24:26") or a snapshot name ("2024-06-20_11-24-26").
+    """
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return snapshot_created(value)
+
+def restore(path, target_folders, backup_location, at=None, destination=None, workers=BACKUP_COPY_WORKERS):
+    """
+    Restores a file or a whole subtree of a target folder as it was at a point in time.
+
+    Args:
+        path: The monitored file or directory to restore.
+        target_folders: A list of paths to the target folders.
+        backup_location: The path to the location where backups are stored.
+        at: A POSIX timestamp; defaults to now, i.e. the latest backup.
+        destination: Where to restore to; defaults to the original location.
+        workers: The number of files restored in parallel.
+
+    Returns:
+        A (restored, failed) tuple of path lists; failed holds files that did not match their
+        digest or could not be restored at all. Both are empty if no backup holds the path.
+    """
+    at = time.time() if at is None else at
+    path = os.path.normpath(path)
+    relative_path = _snapshot_relative_path(path, target_folders)
+    if relative_path is None:
+        relative_path = next((os.path.basename(folder) for folder in target_folders if os.path.normpath(folder) == path), None)
+    if relative_path is None:
+        raise ValueError(f"{path} is not inside a monitored folder")
+
+    versions = get_restore_index(backup_location).lookup_tree(relative_path, at)
+    destination = destination or path
+    jobs = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for version in versions:
+            target = destination + version["path"][len(relative_path):]
+            jobs[pool.submit(restore_file, backup_location, version, target)] = target
+    restored = []
+    failed = []
+    for job, target in jobs.items():
+        try:
+            (restored if job.result() else failed).append(target)
+        except Exception as e:
+            logging.error(f"Could not restore {target}: {e}")
+            failed.append(target)
+    logging.info(f"Restored {len(restored)} files to {destination} as of {datetime.fromtimestamp(at)}; {len(failed)} failed.")
+    return restored, failed
+
+class ProtectedPathGuard:
+    """
+    Change-stream listener that reverts modified or deleted protected files.
 
+    stage() copies the baselined version of every protected file into a stage directory
+    and verifies it once, so a revert is a single local copy and rename that never has to
+    look at the backups. The baseline entry is put back too, so the monitor sees the
+    reverted file as unchanged.
+    """
 
-def process_file_changes(filename, event_id):
+    def __init__(self, protected_paths=None, stage_dir=PROTECTED_STAGE_DIR, baseline=None):
+        self.protected_paths = [os.path.normpath(path) for path in (protected_paths if protected_paths is not None else PROTECTED_PATHS)]
+        self.stage_dir = stage_dir
+        self.baseline = baseline if baseline is not None else get_baseline_store()
+        self.staged = {}  # path -> baseline info of the staged version
+        self.lock = threading.Lock()
+
+    def is_protected(self, path):
+        path = os.path.normpath(path)
+        return any(path == protected or path.startswith(os.path.join(protected, "")) for protected in self.protected_paths)
+
+    def _protected_files(self):
+        for protected in self.protected_paths:
+            if os.path.isdir(protected):
+                for entry in scan_tree(protected):
+                    yield entry.path
+            elif os.path.isfile(protected):
+                yield protected
+
+    def stage(self):
+        """
+        Stages a verified copy of every protected file and drops copies no longer needed.
+
+        A file whose content no longer matches its baseline entry is not staged, since the
+        authorized version is gone; recollect the baseline to accept the current content.
+        """
+        logger = logging.getLogger(__name__)
+        os.makedirs(self.stage_dir, exist_ok=True)
+        staged = {}
+        for path in self._protected_files():
+            stat_result = os.stat(path)
+            info = self.baseline.get(path)
+            if info is None:
+                info = {"hash": calculate_file_hash(path, stat_result=stat_result), "event_id": str(uuid.uuid4()),
+                        "path": path, "signature": file_signature(stat_result)}
+                self.baseline.set(path, info)
+            staged_copy = os.path.join(self.stage_dir, info["hash"])
+            if not os.path.exists(staged_copy) or hash_file_stream(staged_copy) != info["hash"]:
+                temp_file = f"{staged_copy}.tmp"
+                copy_file_fast(path, temp_file)
+                if hash_file_stream(temp_file) != info["hash"]:
+                    os.remove(temp_file)
+                    logger.warning(f"Protected file {path} no longer matches the baseline and was not staged.")
+                    continue
+                os.chmod(temp_file, stat.S_IREAD)
+                os.replace(temp_file, staged_copy)
+            staged[path] = dict(info, mtime_ns=stat_result.st_mtime_ns, mode=stat_result.st_mode)
+        with self.lock:
+            self.staged = staged
+        digests = {info["hash"] for info in staged.values()}
+        for name in os.listdir(self.stage_dir):
+            if name not in digests:
+                os.chmod(os.path.join(self.stage_dir, name), stat.S_IWRITE)
+                os.remove(os.path.join(self.stage_dir, name))
+        logger.info(f"Staged {len(staged)} protected files in {self.stage_dir}.")
+
+    def __call__(self, event_code, path, previous_path=None):
+        if event_code in ("102", "103"):
+            self.revert(path)
+        elif event_code == "104":
+            self.revert(previous_path)
+
+    def revert(self, path):
+        """
+        Atomically puts the staged copy of a protected file back in place.
+
+        Returns:
+            True if the file was reverted, False if it is not a staged protected file.
+        """
+        with self.lock:
+            info = self.staged.get(os.path.normpath(path))
+        if info is None:
+            return False
+        staged_copy = os.path.join(self.stage_dir, info["hash"])
+        temp_file = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.revert-{uuid.uuid4()}")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            copy_file_fast(staged_copy, temp_file)
+            os.chmod(temp_file, stat.S_IMODE(info["mode"]))
+            os.utime(temp_file, ns=(info["mtime_ns"], info["mtime_ns"]))
+            os.replace(temp_file, path)
+        except OSError as e:
+            logging.error(f"Could not revert protected file {path}: {e}")
+            return False
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        stat_result = os.stat(path)
+        self.baseline.set(path, {"hash": info["hash"], "event_id": str(uuid.uuid4()), "path": path,
+                                 "signature": file_signature(stat_result), "content": info.get("content")})
+        logging.getLogger(__name__).info(f"105 File at path: {path}, Action: File has been reverted to its protected copy.")
+        publish_change("105", path)
+        return True
+
+def process_file_changes(filename, event_id, baseline=None):
     """
     Processes changes in a file by comparing it with the baseline and copies the original file to the safe folder.
     
     Args:
     filename: The path to the file to be processed.
     event_id: The unique event ID associated with the file event.
-    safe_folder_path: The path to the safe folder where the original files will be copied.
+    baseline: The shared BaselineStore; defaults to the process-wide store.
     """
     logger = logging.getLogger(__name__)
     
     try:
-        # Load the baseline data
-        baseline_data = {}
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_hash = parts[1]
-                    event_id = parts[2]
-                    baseline_data[path] = {"hash": file_hash, "event_id": event_id}
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
 
         # Calculate hash of the current file
-        current_hash = calculate_file_hash(filename)
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        current_hash = calculate_file_hash(filename, stat_result=stat_result)
         
         # Compare with baseline
-        if filename not in baseline_data:
+        if filename not in baseline:
             logger.info(f"101 File at path: {filename}, Action: New file detected.")
-        elif current_hash != baseline_data[filename]["hash"]:
+        elif current_hash != baseline.get(filename)["hash"]:
             logger.info(f"103 File at path: {filename}, Action: File changed.")
         else:
             logger.info(f"100 File at path: {filename}, Action: No change in file.")
         
         # Update baseline data with new hash
-        baseline_data[filename] = {"hash": current_hash, "event_id": event_id}
-        
-        # Save updated baseline data
-        with open("baseline.txt", "w") as f:
-            for path, info in baseline_data.items():
-                f.write(f"{path}|{info['hash']}|{info['event_id']}\n")
-    
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature})
+
     except Exception as e:
         logger.error(f"Error processing changes in {filename}: {e}")
 
 
 
         
-def process_image_changes(filename, event_id):
+def process_image_changes(filename, event_id, baseline=None):
     """
     Processes changes in an image file by comparing it with the baseline.
 
     Args:
         filename: The path to the image file to be processed.
         event_id: The unique event ID associated with the file event.
+        baseline: The shared BaselineStore; defaults to the process-wide store.
     """
     logger = logging.getLogger(__name__)
     try:
-        # Load the baseline data
-        baseline_data = {}
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_hash = parts[1]
-                    event_id = parts[2]
-                    baseline_data[path] = {"hash": file_hash, "event_id": event_id}
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
 
         # Calculate hash of the current image
-        current_hash = calculate_file_hash(filename)
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        current_hash = calculate_file_hash(filename, stat_result=stat_result)
 
         # Compare with baseline
-        if filename not in baseline_data:
+        if filename not in baseline:
             logger.info(f"101 File at path: {filename}, Action: New image detected.")
-        elif current_hash != baseline_data[filename]["hash"]:
+        elif current_hash != baseline.get(filename)["hash"]:
             logger.info(f"103 File at path: {filename}, Action: Image changed.")
         else:
             logger.info(f"100 File at path: {filename}, Action: No change in image.")
 
         # Update baseline data with new hash
-        baseline_data[filename] = {"hash": current_hash, "event_id": event_id}
-
-        # Save updated baseline data
-        with open("baseline.txt", "w") as f:
-            for path, info in baseline_data.items():
-                f.write(f"{path}|{info['hash']}|{info['event_id']}\n")
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature})
 
     except Exception as e:
         logger.error(f"Error processing changes in {filename}: {e}")
 
-def process_excel_changes(filename, event_id):
+# Row fingerprints kept per Excel sheet; longer sheets are fingerprinted in blocks of rows
+EXCEL_FINGERPRINT_MAX_ROWS = 65536
+
+# Changes listed in one change event before the list is cut short
+CHANGES_MAX_REPORTED = 20
+
+# Longest changed stretch of rows or paragraphs aligned with difflib, which is quadratic on repetitive input
+FINGERPRINT_ALIGN_MAX_ITEMS = 1000
+
+# Parts of an OOXML package (.docx/.xlsx/.pptx) that only hold document properties, not content
+OOXML_METADATA_PREFIXES = ("docProps/",)
+
+def ooxml_members(filename):
+    """
+    Fingerprints every part of an OOXML package from the ZIP central directory alone.
+
+    The central directory already records the CRC-32 and uncompressed size of each
+    member, so nothing is decompressed, and recompressing or reordering the package
+    leaves the fingerprints unchanged.
+
+    Returns:
+        A dictionary mapping part names, e.g. 'word/document.xml', to "crc:size" strings.
+    """
+    with zipfile.ZipFile(filename) as archive:
+        return {info.filename: f"{info.CRC:08x}:{info.file_size}" for info in archive.infolist()}
+
+def diff_ooxml_members(old, new):
+    """
+    Compares two ooxml_members results.
+
+    Returns:
+        A (content_parts, metadata_parts) tuple of sorted lists of added, removed or changed part names.
+    """
+    changed = sorted(name for name in old.keys() | new.keys() if old.get(name) != new.get(name))
+    content_parts = [name for name in changed if not name.startswith(OOXML_METADATA_PREFIXES)]
+    metadata_parts = [name for name in changed if name.startswith(OOXML_METADATA_PREFIXES)]
+    return content_parts, metadata_parts
+
+def fingerprint_ooxml(filename):
+    """
+    Returns the content fingerprint of a .pptx file: its part fingerprints.
+    """
+    return {"members": ooxml_members(filename)}
+
+def _join_changes(changes):
+    listed = ", ".join(changes[:CHANGES_MAX_REPORTED])
+    if len(changes) > CHANGES_MAX_REPORTED:
+        listed += f" and {len(changes) - CHANGES_MAX_REPORTED} more"
+    return listed
+
+def _fingerprint(data):
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+def _merge_fingerprints(fingerprints):
+    """
+    Halves a packed list of 8-byte fingerprints by hashing neighbours together.
+    """
+    merged = bytearray()
+    for offset in range(0, len(fingerprints), 16):
+        pair = bytes(fingerprints[offset:offset + 16])
+        merged += _fingerprint(pair) if len(pair) == 16 else pair
+    return bytes(merged)
+
+def _column_letter(index):
+    """
+    Returns the Excel column letter of a 0-based column index.
+    """
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def fingerprint_excel(filename, previous=None, changed_parts=None):
+    """
+    Computes the cell-level fingerprint of a workbook, streaming it with openpyxl in read-only mode.
+
+    Every sheet gets an 8-byte fingerprint per row, and per column over (row, value)
+    pairs, so memory stays proportional to the number of rows and columns rather than
+    cells. Sheets longer than EXCEL_FINGERPRINT_MAX_ROWS are fingerprinted in blocks of
+    2, 4, ... rows by pairwise merging. Formulas are compared as written, not as last
+    calculated, and formatting is ignored.
+
+    Args:
+        filename: The path to the workbook.
+        previous: The workbook's previous fingerprint, whose sheets may be reused.
+        changed_parts: The package parts changed since previous (see diff_ooxml_members).
+            Sheets whose worksheet part is unchanged are not read again, unless the shared
+            strings or the workbook part changed.
+
+    Returns:
+        {"members": ooxml_members(filename), "sheets": [{"name", "part", "block", "rows", "columns"}]},
+        with the fingerprints base64 encoded.
+    """
+    openpyxl = lazy_import("openpyxl")
+    reusable = {}
+    if previous is not None and changed_parts is not None and not {"xl/sharedStrings.xml", "xl/workbook.xml"} & set(changed_parts):
+        reusable = {sheet["name"]: sheet for sheet in previous.get("sheets", []) if sheet.get("part") and sheet["part"] not in changed_parts}
+    members = ooxml_members(filename)
+    workbook = openpyxl.load_workbook(filename, read_only=True)
+    try:
+        sheets = []
+        for worksheet in workbook.worksheets:
+            part = getattr(worksheet, "_worksheet_path", None)  # Read-only worksheets know their package part
+            if worksheet.title in reusable and reusable[worksheet.title]["part"] == part:
+                sheets.append(reusable[worksheet.title])
+                continue
+            rows = bytearray()
+            columns = []
+            for row_index, row in enumerate(worksheet.iter_rows(values_only=True)):
+                cells = [repr(value).encode() for value in row]
+                while cells and row[len(cells) - 1] is None:
+                    cells.pop()  # Padding to the sheet's dimension is not content
+                rows += _fingerprint(b"\x1f".join(cells))
+                for column_index, cell in enumerate(cells):
+                    if column_index == len(columns):
+                        columns.append(hashlib.blake2b(digest_size=8))
+                    if row[column_index] is not None:
+                        columns[column_index].update(b"%d\x1f%s\x1e" % (row_index, cell))
+            block = 1
+            while len(rows) > EXCEL_FINGERPRINT_MAX_ROWS * 8:
+                rows = _merge_fingerprints(rows)
+                block *= 2
+            sheets.append({
+                "name": worksheet.title,
+                "part": part,
+                "block": block,
+                "rows": base64.b64encode(bytes(rows)).decode("ascii"),
+                "columns": base64.b64encode(b"".join(column.digest() for column in columns)).decode("ascii"),
+            })
+        return {"members": members, "sheets": sheets}
+    finally:
+        workbook.close()
+
+def align_fingerprints(old, new):
+    """
+    Aligns two packed lists of 8-byte fingerprints, like difflib's get_opcodes without the "equal" runs.
+
+    The common prefix and suffix are cut off first, so only the changed stretch is
+    handed to difflib. A stretch longer than FINGERPRINT_ALIGN_MAX_ITEMS is not aligned:
+    items are compared position by position if both sides are equally long, and the
+    whole stretch is reported as replaced otherwise.
+
+    Returns:
+        A list of (tag, old_start, old_end, new_start, new_end) tuples indexing items, with
+        tag one of "replace", "insert" or "delete".
+    """
+    old_items = [old[i:i + 8] for i in range(0, len(old), 8)]
+    new_items = [new[i:i + 8] for i in range(0, len(new), 8)]
+    prefix = 0
+    while prefix < min(len(old_items), len(new_items)) and old_items[prefix] == new_items[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < min(len(old_items), len(new_items)) - prefix
+           and old_items[-1 - suffix] == new_items[-1 - suffix]):
+        suffix += 1
+    old_items, new_items = old_items[prefix:len(old_items) - suffix], new_items[prefix:len(new_items) - suffix]
+
+    if max(len(old_items), len(new_items)) <= FINGERPRINT_ALIGN_MAX_ITEMS:
+        matcher = difflib.SequenceMatcher(None, old_items, new_items, autojunk=False)
+        opcodes = [opcode for opcode in matcher.get_opcodes() if opcode[0] != "equal"]
+    elif len(old_items) == len(new_items):
+        opcodes = []
+        for index, (old_item, new_item) in enumerate(zip(old_items, new_items)):
+            if old_item == new_item:
+                continue
+            if opcodes and opcodes[-1][2] == index:
+                opcodes[-1] = ("replace", opcodes[-1][1], index + 1, opcodes[-1][3], index + 1)
+            else:
+                opcodes.append(("replace", index, index + 1, index, index + 1))
+    else:
+        opcodes = [("replace", 0, len(old_items), 0, len(new_items))]
+    return [(tag, prefix + old_start, prefix + old_end, prefix + new_start, prefix + new_end)
+            for tag, old_start, old_end, new_start, new_end in opcodes]
+
+def diff_excel_fingerprints(old, new):
+    """
+    Compares two fingerprint_excel results.
+
+    Rows are aligned with align_fingerprints, so inserted or deleted rows do not show up
+    as every following row changing. Column fingerprints cover the whole sheet, so they only
+    name the edited cells, e.g. "Sheet1!B5" or "Sheet1!B5, Sheet1!D5", when the only change
+    to a sheet is a single modified row; otherwise modified rows are reported whole, e.g.
+    "Sheet1!3:3".
+
+    Returns:
+        A list of change descriptions; empty if no cell content changed.
+    """
+    changes = []
+    old_sheets = {sheet["name"]: sheet for sheet in old["sheets"]}
+    new_sheets = {sheet["name"]: sheet for sheet in new["sheets"]}
+    for name in old_sheets.keys() - new_sheets.keys():
+        changes.append(f"sheet '{name}' removed")
+    for name in [sheet["name"] for sheet in new["sheets"] if sheet["name"] not in old_sheets]:
+        changes.append(f"sheet '{name}' added")
+
+    for name in [sheet["name"] for sheet in new["sheets"] if sheet["name"] in old_sheets]:
+        old_sheet, new_sheet = old_sheets[name], new_sheets[name]
+        if old_sheet["rows"] == new_sheet["rows"] and old_sheet["columns"] == new_sheet["columns"]:
+            continue
+        old_rows, new_rows = base64.b64decode(old_sheet["rows"]), base64.b64decode(new_sheet["rows"])
+        block = max(old_sheet["block"], new_sheet["block"])
+        for _ in range(block.bit_length() - old_sheet["block"].bit_length()):
+            old_rows = _merge_fingerprints(old_rows)
+        for _ in range(block.bit_length() - new_sheet["block"].bit_length()):
+            new_rows = _merge_fingerprints(new_rows)
+        opcodes = align_fingerprints(old_rows, new_rows)
+        if block == 1 and len(opcodes) == 1 and opcodes[0][0] == "replace" and opcodes[0][2] - opcodes[0][1] == opcodes[0][4] - opcodes[0][3] == 1:
+            # A single edited row: the changed column fingerprints are exactly its edited cells
+            old_columns, new_columns = base64.b64decode(old_sheet["columns"]), base64.b64decode(new_sheet["columns"])
+            changed_columns = [
+                index for index in range(max(len(old_columns), len(new_columns)) // 8)
+                if old_columns[index * 8:index * 8 + 8] != new_columns[index * 8:index * 8 + 8]
+            ]
+            if changed_columns:
+                changes.extend(f"{name}!{_column_letter(index)}{opcodes[0][3] + 1}" for index in changed_columns)
+                continue
+
+        def rows_text(start, end):
+            first_row, last_row = start * block + 1, end * block
+            return f"{name} row {first_row}" if first_row == last_row else f"{name} rows {first_row}-{last_row}"
+
+        for tag, old_start, old_end, new_start, new_end in opcodes:
+            if tag == "replace":
+                changes.append(f"{name}!{new_start * block + 1}:{new_end * block}")
+            elif tag == "insert":
+                changes.append(f"{rows_text(new_start, new_end)} inserted")
+            elif tag == "delete":
+                changes.append(f"{rows_text(old_start, old_end)} deleted")
+    return changes
+
+def process_excel_changes(filename, event_id, baseline=None):
     """
     Processes changes in an Excel file by comparing it with the baseline.
 
+    When the baseline holds a cell-level fingerprint, the changed cell ranges are reported,
+    and a save that changed no cell content is logged as such instead of as a modification.
+    The package's central directory is checked first: if only document properties changed
+    no sheet is read, and otherwise only sheets whose part changed are read again.
+
     Args:
         filename: The path to the Excel file to be processed.
         event_id: The unique event ID associated with the file event.
+        baseline: The shared BaselineStore; defaults to the process-wide store.
     """
     logger = logging.getLogger(__name__)
     try:
-        # Load the baseline data
-        baseline_data = {}
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_checksum = parts[1]
-                    event_id = parts[2]
-                    baseline_data[path] = {"checksum": file_checksum, "event_id": event_id}
-
-        # Calculate checksum of the current Excel file
-        current_checksum = calculate_file_checksum(filename)
-
-        # Compare checksum with the baseline
-        if filename not in baseline_data:
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
+
+        # Calculate hash of the current Excel file
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        current_hash = calculate_file_hash(filename, stat_result=stat_result)
+        info = baseline.get(filename)
+        previous = info.get("content") if info is not None else None
+        content = None
+        content_parts = None
+        try:
+            if previous is not None and "members" in previous:
+                content_parts, _ = diff_ooxml_members(previous["members"], ooxml_members(filename))
+                if not content_parts:
+                    content = dict(previous, members=ooxml_members(filename))  # No cell can have changed
+            if content is None:
+                content = fingerprint_excel(filename, previous, content_parts)
+        except Exception as e:
+            logger.warning(f"Could not read cells of {filename}: {e}")
+
+        # Compare hash with the baseline
+        if info is None:
             logger.info(f"101 File at path: {filename}, Action: New Excel file detected.")
-        elif current_checksum != baseline_data[filename]["checksum"]:
-            logger.info(f"103 File at path: {filename}, Action: Excel file has modified.")
+        elif current_hash != info["hash"]:
+            if content_parts == []:
+                logger.info(f"100 File at path: {filename}, Action: Excel file saved without content changes (document properties only).")
+            elif content is not None and previous is not None and "sheets" in previous:
+                # Parts other than the sheets and their strings (media, external links, ...) are not covered by the cell diff
+                cell_parts = {sheet.get("part") for sheet in content["sheets"]} | {"xl/sharedStrings.xml"}
+                changes = diff_excel_fingerprints(previous, content)
+                changes += [f"part {name}" for name in content_parts or [] if name not in cell_parts]
+                if not changes:
+                    logger.info(f"100 File at path: {filename}, Action: Excel file saved without cell changes.")
+                else:
+                    logger.info(f"103 File at path: {filename}, Action: Excel file has modified. Changed: {_join_changes(changes)}")
+            else:
+                logger.info(f"103 File at path: {filename}, Action: Excel file has modified.")
         else:
             logger.info(f"100 File at path: {filename}, Action: No change in Excel file.")
 
-        # Update baseline data with new checksum
-        baseline_data[filename] = {"checksum": current_checksum, "event_id": event_id}
-
-        # Save updated baseline data
-        with open("baseline.txt", "w") as f:
-            for path, info in baseline_data.items():
-                f.write(f"{path}|{info['checksum']}|{info['event_id']}\n")
+        # Update baseline data with new hash
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature, "content": content})
 
     except Exception as e:
         logger.error(f"Error processing changes in {filename}: {e}")
 
-def calculate_file_checksum(filepath):
+def calculate_file_checksum(filepath, use_cache=True, stat_result=None):
     """Calculates the checksum of a file.
     
     Args:
         filepath: The path to the file.
+        use_cache: If True, reuse a digest from the hash cache when the file is unchanged.
+        stat_result: An os.stat_result for the file, if the caller already has one.
         
     Returns:
         A string containing the checksum of the file.
     """
-    with open(filepath, "rb") as f:
-        data = f.read()
-        return hashlib.sha256(data).hexdigest()
+    return cached_file_hash(filepath, "sha256", use_cache=use_cache, stat_result=stat_result)
     
-def process_word_changes(filename, event_id):
+def fingerprint_word(filename, previous=None, changed_parts=None):
+    """
+    Computes the paragraph-level fingerprint of a Word document with python-docx.
+
+    Every body paragraph gets an 8-byte fingerprint of its style and text, and every
+    table one of its cell texts, so run formatting and the revision ids Word rewrites
+    on each save are ignored.
+
+    Args:
+        filename: The path to the Word document.
+        previous: The document's previous fingerprint, whose hashes may be reused.
+        changed_parts: The package parts changed since previous (see diff_ooxml_members).
+            The document is only parsed when word/document.xml changed.
+
+    Returns:
+        {"members": ooxml_members(filename), "paragraphs", "tables"}, with the fingerprints base64 encoded.
+    """
+    members = ooxml_members(filename)
+    if previous is not None and changed_parts is not None and "paragraphs" in previous and "word/document.xml" not in changed_parts:
+        return dict(previous, members=members)
+
+    docx = lazy_import("docx")
+    document = docx.Document(filename)
+    paragraphs = bytearray()
+    for paragraph in document.paragraphs:
+        style = paragraph.style.name if paragraph.style is not None else ""
+        paragraphs += _fingerprint(f"{style}\x00{paragraph.text}".encode("utf-8"))
+    tables = bytearray()
+    for table in document.tables:
+        text = "\n".join("\t".join(cell.text for cell in row.cells) for row in table.rows)
+        tables += _fingerprint(text.encode("utf-8"))
+    return {
+        "members": members,
+        "paragraphs": base64.b64encode(bytes(paragraphs)).decode("ascii"),
+        "tables": base64.b64encode(bytes(tables)).decode("ascii"),
+    }
+
+def _diff_fingerprint_lists(old, new, noun):
+    """
+    Aligns two packed lists of 8-byte fingerprints with align_fingerprints and describes the differences.
+
+    Returns:
+        A list of descriptions such as "paragraph 4 modified" or "paragraphs 7-9 added", 1-based;
+        removals are numbered as in the old document, everything else as in the new one.
+    """
+    def span(start, end):
+        return f"{noun} {start + 1}" if end - start == 1 else f"{noun}s {start + 1}-{end}"
+
+    changes = []
+    for tag, old_start, old_end, new_start, new_end in align_fingerprints(old, new):
+        if tag == "replace":
+            changes.append(f"{span(new_start, new_end)} modified")
+        elif tag == "insert":
+            changes.append(f"{span(new_start, new_end)} added")
+        elif tag == "delete":
+            changes.append(f"{span(old_start, old_end)} removed")
+    return changes
+
+def diff_word_fingerprints(old, new):
+    """
+    Compares two fingerprint_word results.
+
+    Returns:
+        A list of change descriptions; empty if no paragraph or table text changed.
+    """
+    return (_diff_fingerprint_lists(base64.b64decode(old["paragraphs"]), base64.b64decode(new["paragraphs"]), "paragraph")
+            + _diff_fingerprint_lists(base64.b64decode(old["tables"]), base64.b64decode(new["tables"]), "table"))
+
+def process_word_changes(filename, event_id, baseline=None):
     logger = logging.getLogger(__name__)
     try:
         if filename.startswith('~$'):
             # Skip temporary Word files
             return
 
-        # Load the baseline data
-        baseline_data = {}
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_hash = parts[1]
-                    file_event_id = parts[2]
-                    baseline_data[path] = {"hash": file_hash, "event_id": file_event_id}
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
 
         # Check if the file exists
         if not os.path.exists(filename):
-            if filename in baseline_data:
+            if filename in baseline:
                 logger.info(f"102 File at path: {event_id} {filename}, Action: Word document has been deleted.")
-                del baseline_data[filename]
+                baseline.remove(filename)
             else:
                 logger.warning(f"*** {event_id}] [{filename}] Word document deletion event occurred but not tracked.")
             return
 
         # Calculate hash of the current Word document
-        current_hash = calculate_file_hash(filename)
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        current_hash = calculate_file_hash(filename, stat_result=stat_result)
+
+        # Fingerprint the document's parts from the ZIP central directory, then its paragraphs if they can have changed
+        previous = (baseline.get(filename) or {}).get("content")
+        content = None
+        content_parts = None
+        try:
+            if previous is not None and "members" in previous:
+                content_parts, _ = diff_ooxml_members(previous["members"], ooxml_members(filename))
+            content = fingerprint_word(filename, previous, content_parts)
+        except Exception as e:
+            logger.warning(f"Could not read the paragraphs of {filename}: {e}")
 
         # Check if the file is not a temporary Word file and not in baseline data
-        if not filename.startswith('~$') and filename not in baseline_data:
+        if not filename.startswith('~$') and filename not in baseline:
             logger.info(f"101 File at path: {event_id} {filename}, Action: New Word document detected.")
-        elif filename in baseline_data and current_hash != baseline_data[filename]["hash"]:
-            logger.info(f"103 File at path: {filename}, Action: Word document changed.")
-        elif filename in baseline_data:
+        elif filename in baseline and current_hash != baseline.get(filename)["hash"]:
+            if content_parts == []:
+                logger.info(f"100 File at path: {filename}, Action: Word document saved without content changes (document properties only).")
+            elif content is not None and previous is not None and "paragraphs" in previous:
+                # Parts other than the body (media, headers, footers, ...) are not covered by the paragraph diff
+                changes = diff_word_fingerprints(previous, content)
+                changes += [f"part {name}" for name in content_parts or [] if name != "word/document.xml"]
+                if not changes:
+                    logger.info(f"100 File at path: {filename}, Action: Word document saved without paragraph changes.")
+                else:
+                    logger.info(f"103 File at path: {filename}, Action: Word document changed. Changed: {_join_changes(changes)}")
+            elif content_parts:
+                logger.info(f"103 File at path: {filename}, Action: Word document changed. Changed parts: {_join_changes(content_parts)}")
+            else:
+                logger.info(f"103 File at path: {filename}, Action: Word document changed.")
+        elif filename in baseline:
             logger.info(f"100 File at path: {event_id} {filename}, Action: No change in Word document.")
 
-        # Update baseline data with new hash and event_id
-        baseline_data[filename] = {"hash": current_hash, "event_id": event_id}
+        # Update baseline data with new hash and event_id
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature, "content": content})
+
+    except Exception as e:
+        logger.error(f"Error processing changes in {filename}: {e}")
+
+
+# End-of-file marker closing the original body and every incremental update of a PDF
+PDF_EOF_MARKER = b"%%EOF"
+
+# If True, incremental PDF updates are also opened with PyPDF2 to report pages, annotations and signatures
+PDF_STRUCTURE_DETAIL = False
+
+def hash_pdf_update(filename, old_size, old_digest, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Hashes a PDF that grew, checking in the same pass whether it only had data appended.
+
+    The SHA512 state is copied at the old length and compared with the old digest, so the
+    unchanged prefix is verified without a second read, and the same state carries on
+    over the new tail, in which the %%EOF markers of appended revisions are counted.
+
+    Args:
+        filename: The path to the PDF file.
+        old_size: The file's size when old_digest was taken.
+        old_digest: The SHA512 hex digest of the file at old_size.
+        chunk_size: The number of bytes read per chunk.
+
+    Returns:
+        A (digest, prefix_unchanged, appended_revisions) tuple.
+    """
+    hasher = hashlib.sha512()
+    prefix_unchanged = old_size == 0 and hasher.hexdigest() == old_digest
+    appended_revisions = 0
+    position = 0
+    carry = b""
+    count_syscall("open_calls")
+    with open(filename, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if position < old_size <= position + len(chunk):
+                boundary = old_size - position
+                hasher.update(chunk[:boundary])
+                prefix_unchanged = hasher.copy().hexdigest() == old_digest
+                hasher.update(chunk[boundary:])
+                tail = chunk[boundary:]
+            else:
+                hasher.update(chunk)
+                tail = chunk if position >= old_size else b""
+            if tail:
+                window = carry + tail
+                appended_revisions += window.count(PDF_EOF_MARKER)
+                carry = window[-(len(PDF_EOF_MARKER) - 1):]
+            position += len(chunk)
+    return hasher.hexdigest(), prefix_unchanged, appended_revisions
+
+# Incremental-update checks check_file already made, for process_pdf_changes: path -> (signature, digest, appended_revisions)
+_pdf_updates = {}
+
+def hash_pdf_file(filename, stat_result, info, use_cache=True):
+    """
+    Hashes a PDF, checking for an incremental update in the same pass if it grew past its baseline size.
+
+    The check runs even when the hash cache holds a digest, since that digest says nothing
+    about the old bytes; its result is put in the cache.
+
+    Args:
+        filename: The path to the PDF file.
+        stat_result: An os.stat_result for the file.
+        info: The file's baseline info, or None.
+        use_cache: If False, a PDF that did not grow is hashed even on a hash cache hit.
+
+    Returns:
+        A (digest, appended_revisions) tuple; appended_revisions is None unless the file
+        grew with its old bytes intact.
+    """
+    if info is None or not info.get("signature") or stat_result.st_size <= info["signature"][0]:
+        return calculate_file_hash(filename, use_cache=use_cache, stat_result=stat_result), None
+    digest, prefix_unchanged, appended_revisions = hash_pdf_update(filename, info["signature"][0], info["hash"])
+    count_syscall("stat_calls")
+    if file_signature(os.stat(filename)) == file_signature(stat_result):
+        hash_cache.put(filename, stat_result, "sha512", digest)
+    return digest, appended_revisions if prefix_unchanged else None
+
+def describe_pdf_structure(filename):
+    """
+    Summarizes the structure of a PDF with PyPDF2, e.g. "12 pages, 3 annotations, 1 signature field".
+    """
+    PyPDF2 = lazy_import("PyPDF2")
+    reader = PyPDF2.PdfReader(filename)
+    annotations = 0
+    for page in reader.pages:
+        annots = page.get("/Annots")
+        annotations += len(annots.get_object()) if annots is not None else 0
+    signatures = sum(1 for field in (reader.get_fields() or {}).values() if field.get("/FT") == "/Sig")
+    return f"{len(reader.pages)} pages, {annotations} annotations, {signatures} signature fields"
+
+def process_pdf_changes(filename, event_id, baseline=None):
+    """
+    Processes changes in a PDF file by comparing it with the baseline.
+
+    A PDF that grew is checked for an incremental update (a new xref section and trailer
+    appended, as annotation and signing tools do): if the old bytes are intact, the
+    number of appended revisions is reported, with PyPDF2 only opened when
+    PDF_STRUCTURE_DETAIL is set.
+
+    Args:
+        filename: The path to the PDF file to be processed.
+        event_id: The unique event ID associated with the file event.
+        baseline: The shared BaselineStore; defaults to the process-wide store.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
+
+        # Calculate hash of the current PDF file, in one pass with the append check if it grew,
+        # unless check_file already did so while hashing it
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        info = baseline.get(filename)
+        update = _pdf_updates.pop(filename, None)
+        if update is not None and update[0] == signature:
+            _, current_hash, appended_revisions = update
+        else:
+            current_hash, appended_revisions = hash_pdf_file(filename, stat_result, info)
+
+        # Compare with baseline
+        if info is None:
+            logger.info(f"101 File at path: {filename}, Action: New PDF document detected.")
+        elif current_hash != info["hash"] and appended_revisions is not None:
+            detail = ""
+            if PDF_STRUCTURE_DETAIL:
+                try:
+                    detail = f" Structure: {describe_pdf_structure(filename)}."
+                except Exception as e:
+                    logger.warning(f"Could not read the structure of {filename}: {e}")
+            logger.info(f"103 File at path: {filename}, Action: PDF document updated incrementally, {appended_revisions} revision(s) appended.{detail}")
+        elif current_hash != info["hash"]:
+            logger.info(f"103 File at path: {filename}, Action: PDF document changed.")
+        else:
+            logger.info(f"100 File at path: {filename}, Action: No change in PDF document.")
 
-        # Save updated baseline data
-        with open("baseline.txt", "w") as f:
-            for path, info in baseline_data.items():
-                f.write(f"{path}|{info['hash']}|{info['event_id']}\n")
+        # Update baseline data with new hash
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature})
 
     except Exception as e:
         logger.error(f"Error processing changes in {filename}: {e}")
 
+def _describe_pptx_part(name):
+    match = re.fullmatch(r"ppt/slides/slide(\d+)\.xml", name)
+    return f"slide {match.group(1)}" if match else name
 
-def process_pdf_changes(filename, event_id):
+def process_pptx_changes(filename, event_id, baseline=None):
     """
-    Processes changes in a PDF file by comparing it with the baseline.
+    Processes changes in a PowerPoint file by comparing its parts with the baseline.
 
     Args:
-        filename: The path to the PDF file to be processed.
+        filename: The path to the PowerPoint file to be processed.
         event_id: The unique event ID associated with the file event.
+        baseline: The shared BaselineStore; defaults to the process-wide store.
     """
     logger = logging.getLogger(__name__)
     try:
-        # Load the baseline data
-        baseline_data = {}
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_hash = parts[1]
-                    event_id = parts[2]
-                    baseline_data[path] = {"hash": file_hash, "event_id": event_id}
-
-        # Calculate hash of the current PDF file
-        current_hash = calculate_file_hash(filename)
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
+
+        # Calculate hash of the current presentation and fingerprint its parts
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        current_hash = calculate_file_hash(filename, stat_result=stat_result)
+        info = baseline.get(filename)
+        try:
+            content = fingerprint_ooxml(filename)
+        except Exception as e:
+            logger.warning(f"Could not read the parts of {filename}: {e}")
+            content = None
 
         # Compare with baseline
-        if filename not in baseline_data:
-            logger.info(f"101 File at path: {filename}, Action: New PDF document detected.")
-        elif current_hash != baseline_data[filename]["hash"]:
-            logger.info(f"103 File at path: {filename}, Action: PDF document changed.")
+        if info is None:
+            logger.info(f"101 File at path: {filename}, Action: New PowerPoint presentation detected.")
+        elif current_hash != info["hash"]:
+            previous = info.get("content")
+            if content is not None and previous is not None and "members" in previous:
+                content_parts, _ = diff_ooxml_members(previous["members"], content["members"])
+                if not content_parts:
+                    logger.info(f"100 File at path: {filename}, Action: PowerPoint presentation saved without content changes (document properties only).")
+                else:
+                    changed = [_describe_pptx_part(name) for name in content_parts]
+                    logger.info(f"103 File at path: {filename}, Action: PowerPoint presentation changed. Changed: {_join_changes(changed)}")
+            else:
+                logger.info(f"103 File at path: {filename}, Action: PowerPoint presentation changed.")
         else:
-            logger.info(f"100 File at path: {filename}, Action: No change in PDF document.")
+            logger.info(f"100 File at path: {filename}, Action: No change in PowerPoint presentation.")
 
         # Update baseline data with new hash
-        baseline_data[filename] = {"hash": current_hash, "event_id": event_id}
-
-        # Save updated baseline data
-        with open("baseline.txt", "w") as f:
-            for path, info in baseline_data.items():
-                f.write(f"{path}|{info['hash']}|{info['event_id']}\n")
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature, "content": content})
 
     except Exception as e:
         logger.error(f"Error processing changes in {filename}: {e}")
 
-def process_text_changes(filename, event_id):
+def process_text_changes(filename, event_id, baseline=None):
     """
     Processes changes in a text file by comparing it with the baseline.
 
     Args:
         filename: The path to the text file to be processed.
         event_id: The unique event ID associated with the file event.
+        baseline: The shared BaselineStore; defaults to the process-wide store.
     """
     logger = logging.getLogger(__name__)
     try:
-        # Load the baseline data
-        baseline_data = {}
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_hash = parts[1]
-                    event_id = parts[2]
-                    baseline_data[path] = {"hash": file_hash, "event_id": event_id}
+        # Use the shared in-memory baseline
+        baseline = baseline if baseline is not None else get_baseline_store()
 
         # Calculate hash of the current text file
-        current_hash = calculate_file_hash(filename)
+        stat_result = os.stat(filename)
+        signature = file_signature(stat_result)
+        current_hash = calculate_file_hash(filename, stat_result=stat_result)
 
         # Compare with baseline
-        if filename not in baseline_data:
+        if filename not in baseline:
             logger.info(f"101 File at path: {filename}, Action: New text file detected.")
-        elif current_hash != baseline_data[filename]["hash"]:
+        elif current_hash != baseline.get(filename)["hash"]:
             logger.info(f"103 File at path: {filename}, Action: Text file changed.")
         else:
             logger.info(f"100 File at path: {filename}, Action: No change in text file.")
 
         # Update baseline data with new hash
-        baseline_data[filename] = {"hash": current_hash, "event_id": event_id}
-
-        # Save updated baseline data
-        with open("baseline.txt", "w") as f:
-            for path, info in baseline_data.items():
-                f.write(f"{path}|{info['hash']}|{info['event_id']}\n")
+        baseline.set(filename, {"hash": current_hash, "event_id": event_id, "signature": signature})
 
     except Exception as e:
         logger.error(f"Error processing changes in {filename}: {e}")
 
+# File type name -> {"extensions", "handler", "requires", "fingerprint"}; see register_file_type
+FILE_TYPE_HANDLERS = {}
+
+# Lower-case extension -> file type name
+_extension_types = {}
+
+# Parser libraries the built-in handlers may use, benchmarked by benchmark_handler_imports
+HANDLER_LIBRARIES = ["openpyxl", "PIL", "docx", "PyPDF2", "pptx"]
+
+# Modules imported by lazy_import, and how long each import took in seconds
+_lazy_modules = {}
+lazy_import_timings = {}
+_lazy_import_lock = threading.Lock()
+
+# Entry point group through which installed packages register handlers
+PLUGIN_ENTRY_POINT_GROUP = "fim.file_types"
+_plugins_loaded = False
+
+def lazy_import(module_name):
+    """
+    Imports a handler's parser library on first use and returns the module.
+
+    Heavy libraries like openpyxl are only loaded once a file that needs them changes,
+    instead of on every start of the monitor.
+    """
+    module = _lazy_modules.get(module_name)
+    if module is None:
+        with _lazy_import_lock:
+            if module_name not in _lazy_modules:
+                started = time.perf_counter()
+                _lazy_modules[module_name] = importlib.import_module(module_name)
+                lazy_import_timings[module_name] = time.perf_counter() - started
+                logging.getLogger(__name__).debug(f"Imported {module_name} in {lazy_import_timings[module_name]:.3f}s")
+            module = _lazy_modules[module_name]
+    return module
+
+def register_file_type(name, extensions, handler, requires=(), fingerprint=None):
+    """
+    Registers the handler that processes changed files of a type.
+
+    Third-party code can call this directly, or ship a package exposing a
+    "fim.file_types" entry point: a callable that is passed register_file_type.
+
+    Args:
+        name: The file type name returned by check_file_type, e.g. 'excel'.
+        extensions: File extensions, e.g. ['.xlsx']; matched case-insensitively.
+        handler: A callable handler(filename, event_id, baseline), or None to only log the change.
+        requires: Modules to import through lazy_import before the handler first runs.
+        fingerprint: A callable fingerprint(filename) returning a JSON-serializable content
+            fingerprint, stored in the baseline for the handler to diff against; or None.
+    """
+    FILE_TYPE_HANDLERS[name] = {"extensions": [extension.lower() for extension in extensions], "handler": handler,
+                                "requires": list(requires), "fingerprint": fingerprint}
+    for extension in extensions:
+        _extension_types[extension.lower()] = name
+
+def load_plugin_file_types():
+    """
+    Lets installed packages register their handlers through the "fim.file_types" entry point group, once.
+    """
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+    try:
+        from importlib.metadata import entry_points
+        plugins = entry_points(group=PLUGIN_ENTRY_POINT_GROUP)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Could not look up file type plugins: {e}")
+        return
+    for plugin in plugins:
+        try:
+            plugin.load()(register_file_type)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error loading file type plugin {plugin.name}: {e}")
+
 def check_file_type(filename):
     """
     Checks the type of the file.
@@ -402,79 +2552,738 @@ def check_file_type(filename):
         filename: The path to the file.
 
     Returns:
-        'excel' if the file is an Excel file, 'image' if it's an image file,
-        'word' if it's a Word document, 'pdf' if it's a PDF document,
-        'pptx' if it's a PowerPoint document, None otherwise.
-    """
-    if filename.endswith('.xlsx'):
-        return 'excel'
-    elif filename.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-        return 'image'
-    elif filename.endswith('.docx'):
-        return 'word'
-    elif filename.endswith('.pdf'):
-        return 'pdf'
-    elif filename.endswith('.pptx'):
-        return 'pptx'
-    return None
+        The registered file type name for the file's extension, e.g. 'excel' for a .xlsx
+        file, or None if no handler is registered for it.
+    """
+    load_plugin_file_types()
+    return _extension_types.get(os.path.splitext(filename)[1].lower())
 
-def process_file(filename, event_id):
+def process_file(filename, event_id, baseline=None):
     """
-    Processes a file based on its type.
+    Processes a file with the handler registered for its type.
 
     Args:
         filename: The path to the file to be processed.
         event_id: The unique event ID associated with the file event.
-        safe_folder_path: The path to the safe folder where the original files will be copied.
+        baseline: The shared BaselineStore; defaults to the process-wide store.
     """
     file_type = check_file_type(filename)
     logger = logging.getLogger(__name__)
     try:
-        # Process the file based on its type
-        if file_type == 'excel':
-            process_excel_changes(filename, event_id)
-        elif file_type == 'image':
-            process_image_changes(filename, event_id)
-        elif file_type == 'word':
-            process_word_changes(filename, event_id)
-        elif file_type == 'pdf':
-            process_pdf_changes(filename, event_id)
-        elif file_type == 'txt':
-            process_text_changes(filename, event_id)  # Add this line to handle text files
+        entry = FILE_TYPE_HANDLERS.get(file_type)
+        if entry is not None and entry["handler"] is not None:
+            for module_name in entry["requires"]:
+                lazy_import(module_name)
+            entry["handler"](filename, event_id, baseline)
         else:
             # Handle other file types here
             logger.info(f"103 File at path: {filename}, Action: File has been changed.")
     except Exception as e:
         logger.error(f"Error processing {filename}: {e}")
 
-def calculate_file_hash(filepath):
+register_file_type('excel', ['.xlsx'], process_excel_changes, fingerprint=fingerprint_excel)
+register_file_type('image', ['.jpg', '.jpeg', '.png', '.gif'], process_image_changes)
+register_file_type('word', ['.docx'], process_word_changes, fingerprint=fingerprint_word)
+register_file_type('pdf', ['.pdf'], process_pdf_changes)
+register_file_type('pptx', ['.pptx'], process_pptx_changes, fingerprint=fingerprint_ooxml)
+register_file_type('txt', ['.txt'], process_text_changes)
+
+def file_content_fingerprint(filename):
+    """
+    Returns the content fingerprint of a file from its type's fingerprint function, or None.
+    """
+    entry = FILE_TYPE_HANDLERS.get(check_file_type(filename))
+    if entry is None or entry["fingerprint"] is None:
+        return None
+    try:
+        for module_name in entry["requires"]:
+            lazy_import(module_name)
+        return entry["fingerprint"](filename)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Could not fingerprint {filename}: {e}")
+        return None
+
+def benchmark_handler_imports(modules=None):
+    """
+    Measures the cold import time of each handler library in a fresh interpreter.
+
+    Each module is imported in its own subprocess, so nothing is already cached in
+    sys.modules, which is what every start of the monitor used to pay.
+
+    Returns:
+        A dictionary mapping module names to import seconds, or None if the import failed.
+    """
+    if modules is None:
+        modules = list(HANDLER_LIBRARIES)
+        modules += [module for entry in FILE_TYPE_HANDLERS.values() for module in entry["requires"] if module not in modules]
+    timings = {}
+    for module_name in modules:
+        code = f"import time; started = time.perf_counter(); import {module_name}; print(time.perf_counter() - started)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        timings[module_name] = float(result.stdout) if result.returncode == 0 else None
+        logging.info(f"Import of {module_name}: " + (f"{timings[module_name]:.3f}s" if timings[module_name] is not None else "failed"))
+    return timings
+
+def _get_hash_buffer(chunk_size):
+    """
+    Returns the read buffer of the calling thread, reallocating it only when the chunk size changes.
+    """
+    buffer = getattr(_hash_buffers, "buffer", None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = bytearray(chunk_size)
+        _hash_buffers.buffer = buffer
+    return buffer
+
+def hash_file_stream(filepath, algorithm="sha512", chunk_size=HASH_CHUNK_SIZE):
+    """
+    Hashes a file in fixed-size chunks so peak memory stays constant regardless of file size.
+
+    Args:
+        filepath: The path to the file.
+        algorithm: The hashlib algorithm name.
+        chunk_size: The number of bytes read per chunk.
+
+    Returns:
+        A string containing the hex digest of the file.
+    """
+    hasher = hashlib.new(algorithm)
+    buffer = _get_hash_buffer(chunk_size)
+    view = memoryview(buffer)
+    try:
+        count_syscall("open_calls")
+        with open(filepath, "rb", buffering=0) as f:
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+    finally:
+        view.release()
+    return hasher.hexdigest()
+
+def calculate_file_hash(filepath, chunk_size=HASH_CHUNK_SIZE, use_cache=True, stat_result=None):
     """Calculates the SHA512 hash of a file.
     
     Args:
         filepath: The path to the file.
+        chunk_size: The number of bytes read per chunk.
+        use_cache: If True, reuse a digest from the hash cache when the file is unchanged.
+        stat_result: An os.stat_result for the file, if the caller already has one.
         
     Returns:
         A string containing the SHA512 hash of the file.
     """
-    with open(filepath, "rb") as f:
-        data = f.read()
-        return hashlib.sha512(data).hexdigest()
+    return cached_file_hash(filepath, "sha512", chunk_size, use_cache, stat_result)
+
+class HashCache:
+    """
+    Persistent digest cache keyed by (device, inode, size, mtime_ns).
+
+    Entries also record ctime_ns. On POSIX systems that is the inode change time, so a file
+    whose mtime was reset after a write is still treated as a miss; on Windows it is the
+    creation time and such a write goes unnoticed, which only PARANOID_MODE guards against.
+    The cache is loaded lazily and written back atomically by save().
+    """
+
+    def __init__(self, cache_file=HASH_CACHE_FILE, max_entries=HASH_CACHE_MAX_ENTRIES):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> [ctime_ns, path, {algorithm: digest}]
+        self.paths = {}  # path -> key, so stale digests of a rewritten file are dropped
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(stat_result):
+        return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+    def load(self):
+        """
+        Loads the cache file, ignoring malformed lines.
+        """
+        with self.lock:
+            self.loaded = True
+            if not os.path.exists(self.cache_file):
+                return
+            with open(self.cache_file, "r") as f:
+                for line in f:
+                    parts = line.rstrip("\r\n").split("|", 7)
+                    if len(parts) < 8:
+                        continue
+                    try:
+                        key = tuple(int(value) for value in parts[:4])
+                        ctime_ns = int(parts[4])
+                    except ValueError:
+                        continue
+                    entry = self.entries.setdefault(key, [ctime_ns, parts[7], {}])
+                    entry[2][parts[5]] = parts[6]
+                    self.paths[parts[7]] = key
+
+    def get(self, stat_result, algorithm):
+        """
+        Returns the cached digest for a file, or None on a miss.
+        """
+        if not self.loaded:
+            self.load()
+        key = self.key(stat_result)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == stat_result.st_ctime_ns and algorithm in entry[2]:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2][algorithm]
+            self.misses += 1
+            return None
+
+    def put(self, filepath, stat_result, algorithm, digest):
+        """
+        Stores a digest, evicting the least recently used entries beyond max_entries.
+        """
+        if not self.loaded:
+            self.load()
+        key = self.key(stat_result)
+        with self.lock:
+            old_key = self.paths.get(filepath)
+            if old_key is not None and old_key != key:
+                self.entries.pop(old_key, None)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != stat_result.st_ctime_ns:
+                entry = [stat_result.st_ctime_ns, filepath, {}]
+                self.entries[key] = entry
+            entry[2][algorithm] = digest
+            self.paths[filepath] = key
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.paths.pop(evicted[1], None)
+                self.evictions += 1
+            self.dirty = True
+
+    def invalidate(self, filepath=None):
+        """
+        Drops the entries recorded for a path, or every entry if no path is given.
+        """
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            if filepath is None:
+                self.entries.clear()
+                self.paths.clear()
+            else:
+                key = self.paths.pop(filepath, None)
+                if key is not None:
+                    self.entries.pop(key, None)
+            self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache to disk through a temporary file and an atomic rename.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            temp_file = f"{self.cache_file}.tmp"
+            with open(temp_file, "w") as f:
+                for key, (ctime_ns, path, digests) in self.entries.items():
+                    for algorithm, digest in digests.items():
+                        f.write(f"{key[0]}|{key[1]}|{key[2]}|{key[3]}|{ctime_ns}|{algorithm}|{digest}|{path}\n")
+            os.replace(temp_file, self.cache_file)
+            self.dirty = False
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+hash_cache = HashCache()
+
+def cached_file_hash(filepath, algorithm="sha512", chunk_size=HASH_CHUNK_SIZE, use_cache=True, stat_result=None):
+    """
+    Returns the digest of a file, reusing the hash cache when its identity and stat signature match.
+
+    The digest is only cached if the file's signature is the same before and after hashing,
+    so a file written while it was being read is never cached under its old signature.
+    """
+    if not use_cache:
+        return hash_file_stream(filepath, algorithm, chunk_size)
+    if stat_result is None:
+        count_syscall("stat_calls")
+        stat_result = os.stat(filepath)
+    digest = hash_cache.get(stat_result, algorithm)
+    if digest is None:
+        digest = hash_file_stream(filepath, algorithm, chunk_size)
+        count_syscall("stat_calls")
+        if file_signature(os.stat(filepath)) == file_signature(stat_result):
+            hash_cache.put(filepath, stat_result, algorithm, digest)
+    return digest
+
+def file_signature(stat_result):
+    """
+    Builds the stat signature used to decide whether a file needs rehashing.
+
+    Args:
+        stat_result: An os.stat_result for the file.
+
+    Returns:
+        A (size, mtime_ns, inode, ctime_ns) tuple.
+    """
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_ctime_ns)
+
+def parse_baseline_line(line):
+    """
+    Parses one baseline line into a path and its info dictionary.
+
+    Lines written before stat signatures were recorded only have three fields; their
+    signature is None so the monitor rehashes them once. An optional eighth field holds
+    the content fingerprint of the file type's handler as JSON.
+
+    Returns:
+        A (path, info) tuple, or None if the line is malformed.
+    """
+    parts = line.rstrip("\r\n").split("|")
+    if len(parts) < 3:
+        return None
+    signature = None
+    if len(parts) >= 7:
+        try:
+            signature = tuple(int(value) for value in parts[3:7])
+        except ValueError:
+            signature = None
+    info = {"hash": parts[1], "event_id": parts[2], "signature": signature}
+    if len(parts) >= 8 and parts[7]:
+        try:
+            info["content"] = json.loads(parts[7])
+        except ValueError:
+            pass  # Dropped; the handler records a new fingerprint on the next change
+    return parts[0], info
+
+def format_baseline_line(path, info):
+    """
+    Formats a baseline entry as a line of "baseline.txt".
+    """
+    line = f"{path}|{info['hash']}|{info['event_id']}"
+    signature = info.get("signature")
+    if signature:
+        line += "|" + "|".join(str(value) for value in signature)
+    if info.get("content") is not None:
+        if not signature:
+            line += "||||"
+        line += "|" + _encode_content(info["content"])
+    return line + "\n"
+
+def _encode_content(content):
+    # '|' can only occur inside JSON strings, where its \u escape is equivalent
+    return json.dumps(content, separators=(",", ":")).replace("|", "\\u007c")
+
+def load_baseline(baseline_file=BASELINE_FILE):
+    """
+    Loads the baseline file into a dictionary keyed by path.
+    """
+    baseline_data = {}
+    with open(baseline_file, "r") as f:
+        for line in f:
+            entry = parse_baseline_line(line)
+            if entry:
+                baseline_data[entry[0]] = entry[1]
+    return baseline_data
+
+def save_baseline(baseline_data, baseline_file=BASELINE_FILE):
+    """
+    Writes a dictionary of baseline entries to the baseline file.
+    """
+    with open(baseline_file, "w") as f:
+        for path, info in baseline_data.items():
+            f.write(format_baseline_line(path, info))
+
+class BaselineStore:
+    """
+    In-memory baseline shared by the monitor and the process_*_changes handlers.
+
+    Lookups and updates are dictionary operations. Changed paths are tracked as dirty and
+    written out in batches, through a temporary file and an atomic rename, once
+    flush_events updates have accumulated or flush_interval seconds have passed.
+    """
+
+    def __init__(self, baseline_file=BASELINE_FILE, flush_events=BASELINE_FLUSH_EVENTS, flush_interval=BASELINE_FLUSH_INTERVAL):
+        self.baseline_file = baseline_file
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self.entries = {}
+        self.dirty = set()
+        self.pending_events = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """
+        Replaces the in-memory entries with the contents of the baseline file.
+        """
+        with self.lock:
+            try:
+                self.entries = load_baseline(self.baseline_file)
+            except FileNotFoundError as e:
+                logger.warning(f"Error loading baseline: {e}")
+                self.entries = {}
+            self.dirty.clear()
+            self.pending_events = 0
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path):
+        """
+        Returns the baseline entry of a path, or None if it is not tracked.
+        """
+        return self.entries.get(path)
+
+    def paths(self):
+        """
+        Returns a snapshot of the tracked paths.
+        """
+        with self.lock:
+            return list(self.entries)
+
+    def set(self, path, info):
+        """
+        Adds or replaces the entry of a path and marks it dirty.
+        """
+        with self.lock:
+            self.entries[path] = info
+            self._mark_dirty(path)
+
+    def remove(self, path):
+        """
+        Stops tracking a path.
+        """
+        with self.lock:
+            if self.entries.pop(path, None) is not None:
+                self._mark_dirty(path)
+
+    def _mark_dirty(self, path):
+        self.dirty.add(path)
+        self.pending_events += 1
+        if self.pending_events >= self.flush_events:
+            self.flush()
+
+    def maybe_flush(self):
+        """
+        Flushes pending changes if flush_interval seconds have passed since the last flush.
+        """
+        if self.dirty and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the baseline to a temporary file and atomically renames it over the baseline file.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            temp_file = f"{self.baseline_file}.tmp"
+            save_baseline(self.entries, temp_file)
+            os.replace(temp_file, self.baseline_file)
+            self.dirty.clear()
+            self.pending_events = 0
+            self.last_flush = time.monotonic()
+
+    def find_by_hash(self, file_hash):
+        """
+        Returns the paths whose recorded hash equals file_hash.
+        """
+        with self.lock:
+            return [path for path, info in self.entries.items() if info["hash"] == file_hash]
+
+    def paths_under(self, directory):
+        """
+        Returns the tracked paths inside a directory.
+        """
+        prefix = os.path.join(directory, "")
+        with self.lock:
+            return [path for path in self.entries if path.startswith(prefix)]
+
+def open_baseline_db(db_file=BASELINE_DB):
+    """
+    Opens the SQLite baseline database in WAL mode, creating the schema if needed.
+
+    The path primary key doubles as the index for directory-prefix range queries.
+    """
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS baseline ("
+        "path TEXT PRIMARY KEY, hash TEXT NOT NULL, event_id TEXT NOT NULL, "
+        "size INTEGER, mtime_ns INTEGER, inode INTEGER, ctime_ns INTEGER, content TEXT)"
+    )
+    if "content" not in [row[1] for row in conn.execute("PRAGMA table_info(baseline)")]:
+        conn.execute("ALTER TABLE baseline ADD COLUMN content TEXT")  # Databases created before content fingerprints
+    conn.execute("CREATE INDEX IF NOT EXISTS baseline_hash ON baseline (hash)")
+    conn.commit()
+    return conn
+
+def _baseline_row(path, info):
+    """
+    Converts a baseline entry into a row of the baseline table.
+    """
+    signature = info.get("signature") or (None, None, None, None)
+    content = _encode_content(info["content"]) if info.get("content") is not None else None
+    return (path, info["hash"], info["event_id"], *signature, content)
+
+def insert_baseline_rows(conn, file_info_dict):
+    """
+    Bulk inserts baseline entries in a single transaction.
+    """
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO baseline (path, hash, event_id, size, mtime_ns, inode, ctime_ns, content) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (_baseline_row(path, info) for path, info in file_info_dict.items()),
+        )
+
+def import_baseline_txt(baseline_file=BASELINE_FILE, db_file=BASELINE_DB):
+    """
+    Imports an existing baseline.txt into the SQLite baseline database.
+
+    Returns:
+        The number of imported entries.
+    """
+    baseline_data = load_baseline(baseline_file)
+    conn = open_baseline_db(db_file)
+    try:
+        insert_baseline_rows(conn, baseline_data)
+    finally:
+        conn.close()
+    logger.info(f"Imported {len(baseline_data)} baseline entries from {baseline_file} into {db_file}")
+    return len(baseline_data)
+
+class SQLiteBaselineStore(BaselineStore):
+    """
+    BaselineStore backed by the SQLite baseline database.
+
+    Lookups are still served from memory; dirty paths are written back as one
+    transaction per flush. Hash and directory queries use the database indexes.
+    """
+
+    def __init__(self, db_file=BASELINE_DB, flush_events=BASELINE_FLUSH_EVENTS, flush_interval=BASELINE_FLUSH_INTERVAL):
+        if not os.path.exists(db_file) and os.path.exists(BASELINE_FILE):
+            import_baseline_txt(BASELINE_FILE, db_file)
+        self.conn = open_baseline_db(db_file)
+        super().__init__(db_file, flush_events, flush_interval)
+
+    def load(self):
+        with self.lock:
+            self.entries = {}
+            rows = self.conn.execute("SELECT path, hash, event_id, size, mtime_ns, inode, ctime_ns, content FROM baseline")
+            for path, file_hash, event_id, size, mtime_ns, inode, ctime_ns, content in rows:
+                signature = (size, mtime_ns, inode, ctime_ns) if size is not None else None
+                self.entries[path] = {"hash": file_hash, "event_id": event_id, "signature": signature}
+                if content is not None:
+                    self.entries[path]["content"] = json.loads(content)
+            self.dirty.clear()
+            self.pending_events = 0
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            updated = {path: self.entries[path] for path in self.dirty if path in self.entries}
+            removed = [(path,) for path in self.dirty if path not in self.entries]
+            with self.conn:
+                self.conn.executemany("DELETE FROM baseline WHERE path = ?", removed)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO baseline (path, hash, event_id, size, mtime_ns, inode, ctime_ns, content) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (_baseline_row(path, info) for path, info in updated.items()),
+                )
+            self.dirty.clear()
+            self.pending_events = 0
+            self.last_flush = time.monotonic()
+
+    def find_by_hash(self, file_hash):
+        self.flush()
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT path FROM baseline WHERE hash = ?", (file_hash,))]
+
+    def paths_under(self, directory):
+        prefix = os.path.join(directory, "")
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path FROM baseline WHERE path >= ? AND path < ?", (prefix, prefix + "\U0010ffff")
+            )
+            return [row[0] for row in rows]
+
+_baseline_store = None
+_baseline_store_lock = threading.Lock()
+
+def get_baseline_store():
+    """
+    Returns the process-wide BaselineStore, loading it on first use and flushing it at exit.
+    """
+    global _baseline_store
+    with _baseline_store_lock:
+        if _baseline_store is None:
+            if BASELINE_BACKEND == "sqlite":
+                _baseline_store = SQLiteBaselineStore()
+            else:
+                _baseline_store = BaselineStore()
+            atexit.register(_baseline_store.flush)
+        return _baseline_store
 
 def erase_existing_baseline():
     """
-    Deletes the "baseline.txt" file if it exists.
+    Deletes the "baseline.txt" file if it exists, or empties the baseline database when the SQLite backend is used.
+    """
+    if BASELINE_BACKEND == "sqlite":
+        conn = open_baseline_db()
+        with conn:
+            conn.execute("DELETE FROM baseline")
+        conn.close()
+    elif os.path.exists(BASELINE_FILE):
+        os.remove(BASELINE_FILE)
+
+def scan_tree(target_folder, excluded_dirs=(), onerror=None):
+    """
+    Walks a folder with os.scandir, yielding the DirEntry of every file in os.walk order.
+
+    Directories are streamed rather than listed up front; only the names of pending
+    subdirectories are kept. Symbolic links to directories are not followed, as in os.walk.
+
+    Args:
+        target_folder: The folder to walk.
+        excluded_dirs: Directory names that are not descended into.
+        onerror: Called with the OSError of a directory that cannot be listed.
+    """
+    pending = [target_folder]
+    while pending:
+        directory = pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        yield entry
+                    elif entry.name not in excluded_dirs and not entry.is_symlink():
+                        subdirs.append(entry.path)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+        # Reverse so subdirectories are visited in listing order
+        pending.extend(reversed(subdirs))
+
+def entry_stat(entry):
+    """
+    Returns the stat result of a DirEntry.
+
+    On Windows the stat cached by scandir has st_ino and st_dev set to 0, which would break
+    stat signatures and hash cache keys, so the file is stat'ed by path there.
+    """
+    count_syscall("stat_calls")
+    if os.name == "nt":
+        return os.stat(entry.path)
+    return entry.stat()
+
+def _iter_baseline_files(target_folder):
+    """
+    Yields (path, stat_result) for the files of a target folder, skipping files starting with '$' or '~$'.
+    """
+    for entry in scan_tree(target_folder):
+        # Skip files starting with '$' or '~$'
+        if entry.name.startswith('$') or entry.name.startswith('~$'):
+            continue
+        yield entry.path, entry_stat(entry)
+
+def _hash_baseline_file(full_path):
+    """
+    Worker for parallel baseline collection.
+
+    Returns:
+        A (hash, signature) tuple, where the signature is taken after hashing so the
+        caller can tell whether the file changed while it was being read.
+    """
+    file_hash = hash_file_stream(full_path, "sha512")
+    return file_hash, file_signature(os.stat(full_path))
+
+def _hash_files_serial(files, use_cache=True):
+    """
+    Hashes files one at a time, yielding (path, hash, stat_result) tuples.
+
+    The stat result is taken before hashing, so a write during hashing shows up as a signature change later.
+    """
+    for full_path, stat_result in files:
+        yield full_path, calculate_file_hash(full_path, use_cache=use_cache, stat_result=stat_result), stat_result
+
+def _hash_files_parallel(files, workers, executor, use_cache=True):
+    """
+    Hashes files on a worker pool while the directory walk is still running.
+
+    Cache hits are resolved in the calling process; only misses are sent to the pool.
+    Results are yielded in the same order as the input files, so the output matches
+    the serial path.
+
+    Args:
+        files: An iterable of (path, stat_result) tuples.
+        workers: The number of hashing workers.
+        executor: "process" for a process pool, "thread" for a thread pool.
+        use_cache: If False, every file is hashed, even on a hash cache hit.
     """
-    if os.path.exists("baseline.txt"):
-        os.remove("baseline.txt")
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    max_pending = workers * 4  # Bound the number of files enumerated ahead of the hashers
+    pending = deque()
+
+    def finish(full_path, stat_result, result):
+        if isinstance(result, str):
+            return full_path, result, stat_result
+        file_hash, signature_after = result.result()
+        if signature_after == file_signature(stat_result):
+            hash_cache.put(full_path, stat_result, "sha512", file_hash)
+        return full_path, file_hash, stat_result
+
+    with pool_class(max_workers=workers) as pool:
+        for full_path, stat_result in files:
+            file_hash = hash_cache.get(stat_result, "sha512") if use_cache else None
+            if file_hash is None:
+                pending.append((full_path, stat_result, pool.submit(_hash_baseline_file, full_path)))
+            else:
+                pending.append((full_path, stat_result, file_hash))
+            while len(pending) > max_pending:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
 
-def collect_baseline(target_folders):
+def collect_baseline(target_folders, workers=BASELINE_WORKERS, executor=BASELINE_EXECUTOR, paranoid=PARANOID_MODE):
     """
     Collects baseline information for files in the target folders and their subfolders.
 
     Args:
         target_folders: A list of paths to the target folders.
+        workers: The number of hashing workers; 1 hashes files serially.
+        executor: "process" or "thread", the worker pool used when workers > 1.
+        paranoid: If True, hash every file instead of reusing digests from the hash cache.
     """
     erase_existing_baseline()
+    started = time.perf_counter()
+    total_files = 0
+    total_bytes = 0
 
     # Collect baseline information for each target folder
     for target_folder in target_folders:
@@ -482,108 +3291,395 @@ def collect_baseline(target_folders):
         file_info_dict = {}
 
         # Collect all files in the target folder and its subfolders
-        for root, dirs, files in os.walk(target_folder):
-            for f in files:
-                full_path = os.path.join(root, f)
-                
-                # Skip files starting with '$' or '~$'
-                if f.startswith('$') or f.startswith('~$'):
-                    continue
+        files = _iter_baseline_files(target_folder)
+        if workers > 1:
+            hashed_files = _hash_files_parallel(files, workers, executor, use_cache=not paranoid)
+        else:
+            hashed_files = _hash_files_serial(files, use_cache=not paranoid)
+
+        for full_path, file_hash, stat_result in hashed_files:
+            event_id = str(uuid.uuid4())  # Generate a UUID for the event
+            file_info_dict[full_path] = {"hash": file_hash, "event_id": event_id, "signature": file_signature(stat_result)}
+            content = file_content_fingerprint(full_path)
+            if content is not None:
+                file_info_dict[full_path]["content"] = content
+            total_files += 1
+            total_bytes += stat_result.st_size
+
+        # Save the dictionary to the baseline database or "baseline.txt"
+        if BASELINE_BACKEND == "sqlite":
+            conn = open_baseline_db()
+            try:
+                insert_baseline_rows(conn, file_info_dict)
+            finally:
+                conn.close()
+        else:
+            with open(BASELINE_FILE, "a") as f:  # Use 'a' (append) mode to add to existing baseline
+                for path, info in file_info_dict.items():
+                    f.write(format_baseline_line(path, info))
+
+    hash_cache.save()
+    if _baseline_store is not None:
+        _baseline_store.load()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    logger.info(f"Baseline collected: {total_files} files, {total_bytes} bytes in {elapsed:.2f}s "
+                f"({total_files / elapsed:.1f} files/sec, {total_bytes / elapsed:.0f} bytes/sec)")
+    logger.info(f"Hash cache: {hash_cache.stats()}")
+
+def check_file(full_path, baseline, paranoid=False, stat_result=None):
+    """
+    Compares one file with the baseline, logging and recording it if it is new or changed.
+
+    Args:
+        full_path: The path to the file.
+        baseline: The BaselineStore to compare against.
+        paranoid: If True, rehash the file even if its stat signature is unchanged.
+        stat_result: An os.stat_result for the file, if the caller already has one.
 
-                file_hash = calculate_file_hash(full_path)
-                event_id = str(uuid.uuid4())  # Generate a UUID for the event
-                file_info_dict[full_path] = {"hash": file_hash, "event_id": event_id}
+    Returns:
+        True if the file had to be hashed, False if its stat signature was enough.
+    """
+    logger = logging.getLogger(__name__)
+    if stat_result is None:
+        count_syscall("stat_calls")
+        stat_result = os.stat(full_path)
+    signature = file_signature(stat_result)
+    info = baseline.get(full_path)
+
+    # Check if the file is new (not in the baseline) and doesn't start with '~$'
+    if info is None:
+        event_id = str(uuid.uuid4())  # Generate a UUID for the event
+        file_hash = calculate_file_hash(full_path, stat_result=stat_result)
+        baseline.set(full_path, {"hash": file_hash, "event_id": event_id, "path": full_path, "signature": signature,  # Added "path" key
+                                 "content": file_content_fingerprint(full_path)})
+        
+        # Log new file creation event
+        logger.info(f"101 File at path: {full_path}, Action: New file detected.")
+        publish_change("101", full_path)
+        return True
+
+    # Only rehash when the stat signature moved (or in paranoid mode)
+    hashed = paranoid or signature != info.get("signature")
+    if hashed and check_file_type(full_path) == "pdf":
+        # Hash a grown PDF together with its incremental-update check, handing the result to the handler
+        current_hash, appended_revisions = hash_pdf_file(full_path, stat_result, info, use_cache=not paranoid)
+        if current_hash != info["hash"]:
+            _pdf_updates[full_path] = (signature, current_hash, appended_revisions)
+    elif hashed:
+        current_hash = calculate_file_hash(full_path, use_cache=not paranoid, stat_result=stat_result)
+    else:
+        current_hash = info["hash"]
+    
+    # Check if the file has been modified
+    if current_hash != info["hash"]:
+        event_id = str(uuid.uuid4())  # Generate a UUID for the event
+        process_file(full_path, event_id, baseline)  # Compares against the baseline before it is updated
+        content = (baseline.get(full_path) or {}).get("content")  # Fingerprint the handler recorded
+        baseline.set(full_path, {"hash": current_hash, "event_id": event_id, "path": full_path, "signature": signature, "content": content})
+        publish_change("103", full_path)
+        return hashed  # Skip further checks if file has been modified
+
+    # Content is unchanged; record the new signature so the file is not rehashed again
+    if signature != info.get("signature"):
+        baseline.set(full_path, dict(info, signature=signature))
+
+    # Check for rename operation
+    if full_path != info.get("path", full_path):
+        # Log file renaming event
+        logger.info(f"104 File at path: {info['path']}, Action: File has been renamed to {full_path}")
+        
+        # Update baseline data with new path
+        baseline.remove(info["path"])
+        baseline.set(full_path, dict(info, path=full_path))
+        publish_change("104", full_path, info["path"])
+    return hashed
+
+# Syscall counters of the most recent scan_folders pass
+last_scan_stats = {}
+
+# The counters a scan_folders pass running on this thread adds its stat and open calls to
+_syscall_counters = threading.local()
+
+def count_syscall(kind):
+    """
+    Counts one "stat_calls" or "open_calls" against the scan running on this thread, if any.
+    """
+    stats = getattr(_syscall_counters, "stats", None)
+    if stats is not None:
+        stats[kind] += 1
+
+def _in_scan_scope(path, target_folders, unreadable_dirs):
+    """
+    Returns True if a full scan of the target folders should have seen the path.
+
+    Paths inside excluded directories, outside every target folder, or under a
+    directory the walk could not list are out of scope and never reported as deleted.
+    """
+    for target_folder in target_folders:
+        prefix = os.path.join(target_folder, "")
+        if path.startswith(prefix):
+            if any(part in EXCLUDED_DIRS for part in path[len(prefix):].split(os.sep)[:-1]):
+                return False
+            return not any(path.startswith(os.path.join(d, "")) for d in unreadable_dirs)
+    return False
+
+def scan_folders(target_folders, baseline, paranoid=False):
+    """
+    Runs one full monitoring pass over the target folders.
+
+    Deleted files are found once per pass as the tracked paths the walk did not see,
+    without any extra stat calls. Each file costs one stat; it is only opened when it
+    has to be hashed, and a PermissionError from that open marks it as in use.
+    The syscall counters cover the walk and all hashing (see count_syscall); documents
+    parsed by the file type handler libraries, e.g. openpyxl, are not counted.
+
+    Args:
+        target_folders: A list of paths to the target folders.
+        baseline: The BaselineStore to compare against.
+        paranoid: If True, rehash every file regardless of its signature.
+
+    Returns:
+        A dictionary of syscall counters for the pass.
+    """
+    global last_scan_stats
+    logger = logging.getLogger(__name__)
+    excluded_dirs = EXCLUDED_DIRS
+    stats = {"files": 0, "stat_calls": 0, "open_calls": 0, "deleted": 0}
+    _syscall_counters.stats = stats
+    seen = set()
+    unreadable_dirs = []
 
-        # Save the dictionary to "baseline.txt"
-        with open("baseline.txt", "a") as f:  # Use 'a' (append) mode to add to existing baseline
-            for path, info in file_info_dict.items():
-                f.write(f"{path}|{info['hash']}|{info['event_id']}\n")
+    def on_walk_error(error):
+        unreadable_dirs.append(error.filename)
 
-def monitor_files(target_folders):
+    for target_folder in target_folders:
+        # Exclude certain directories from being processed
+        for entry in scan_tree(target_folder, excluded_dirs, on_walk_error):
+            full_path = entry.path
+            seen.add(full_path)
+            stats["files"] += 1
+            
+            try:
+                stat_result = entry_stat(entry)
+                check_file(full_path, baseline, paranoid, stat_result)
+            except PermissionError:
+                print(f"\n{full_path} is in use, skipping...")
+            except FileNotFoundError:
+                # Deleted between the directory listing and the stat; reported as deleted below
+                seen.discard(full_path)
+
+    # Check for delete operation
+    for path in baseline.paths():
+        if path in seen or not _in_scan_scope(path, target_folders, unreadable_dirs):
+            continue
+        # Log file deletion event 
+        logger.info(f"102 File at path: {path}, Action: File has been deleted")
+        baseline.remove(path)
+        hash_cache.invalidate(path)
+        publish_change("102", path)
+        stats["deleted"] += 1
+
+    _syscall_counters.stats = None
+    last_scan_stats = stats
+    logger.debug(f"Scan syscalls: {stats}")
+    return stats
+
+def monitor_files(target_folders, paranoid=PARANOID_MODE, baseline=None):
     """
     Monitor changes in files within the specified target folders and their subfolders.
 
+    A file is only rehashed when its (size, mtime_ns, inode, ctime_ns) signature differs
+    from the one recorded in the baseline, unless paranoid mode is enabled.
+
     Args:
         target_folders: A list of paths to the target folders.
-        safe_folder_path: The path to the safe folder where the original files will be copied.
+        paranoid: If True, rehash every file on every pass regardless of its signature.
+        baseline: The BaselineStore to monitor against; defaults to the process-wide store.
     """
-    file_info_dict = {}  # Initialize an empty dictionary to store file information
-    excluded_dirs = ['image files']  # Directories to exclude from monitoring
-    
-    try:
-        with open("baseline.txt", "r") as f:
-            for line in f:
-                parts = line.strip().split("|")
-                if len(parts) >= 3:
-                    path = parts[0]
-                    file_hash = parts[1]
-                    event_id = parts[2]
-                    file_info_dict[path] = {"hash": file_hash, "event_id": event_id, "path": path}  # Added "path" key
-    except Exception as e:
-        print(f"Error loading baseline: {e}")
+    baseline = baseline if baseline is not None else get_baseline_store()
 
     while True:
-        time.sleep(5)  # Delay for monitoring
-        
-        for target_folder in target_folders:
-            for root, dirs, files in os.walk(target_folder):
-                # Exclude certain directories from being processed
-                dirs[:] = [d for d in dirs if d not in excluded_dirs]
-                
-                for f in files:
-                    full_path = os.path.join(root, f)
-                    
-                    try:
-                        with open(full_path, "rb") as file_handle:
-                            pass
-                    except PermissionError:
-                        print(f"\n{full_path} is in use, skipping...")
-                        continue
-                    
-                    # Check if the file is new (not in the baseline) and doesn't start with '~$'
-                    if full_path not in file_info_dict:
-                        event_id = str(uuid.uuid4())  # Generate a UUID for the event
-                        file_hash = calculate_file_hash(full_path)
-                        file_info_dict[full_path] = {"hash": file_hash, "event_id": event_id, "path": full_path}  # Added "path" key
-                        
-                        # Log new file creation event
-                        logger = logging.getLogger(__name__)
-                        logger.info(f"101 File at path: {full_path}, Action: New file detected.")
-
-                    # Update baseline information for existing files
-                    else:
-                        current_hash = calculate_file_hash(full_path)
-                        
-                        # Check if the file has been modified
-                        if current_hash != file_info_dict[full_path]["hash"]:
-                            event_id = str(uuid.uuid4())  # Generate a UUID for the event
-                            file_info_dict[full_path]["hash"] = current_hash
-                            file_info_dict[full_path]["event_id"] = event_id
-                            process_file(full_path, event_id)  # Pass safe_folder_path here
-                            continue  # Skip further checks if file has been modified
-
-                        # Check for rename operation
-                        if full_path != file_info_dict[full_path]["path"]:
-                            # Log file renaming event
-                            logger = logging.getLogger(__name__)
-                            logger.info(f"104 File at path: {file_info_dict[full_path]['path']}, Action: File has been renamed to {full_path}")
-                            
-                            # Update baseline data with new path
-                            file_info_dict[full_path] = file_info_dict.pop(file_info_dict[full_path]["path"])
-                            file_info_dict[full_path]["path"] = full_path
-                            continue  # Skip further checks if file has been renamed
-
-                # Check for delete operation
-                for path in list(file_info_dict.keys()):
-                    if not os.path.exists(path):
-                        # Log file deletion event 
-                        logger = logging.getLogger(__name__)
-                        logger.info(f"102 File at path: {path}, Action: File has been deleted")
-                        del file_info_dict[path]
-
-
-
-                
+        time.sleep(MONITOR_INTERVAL)  # Delay for monitoring
+        monitor_pass(target_folders, baseline, paranoid)
+
+def monitor_pass(target_folders, baseline, paranoid=PARANOID_MODE):
+    """
+    Runs one poll-mode pass: scans the target folders, then persists the baseline and digests changed during it.
+
+    Returns:
+        The scan statistics of scan_folders.
+    """
+    stats = scan_folders(target_folders, baseline, paranoid)
+    baseline.maybe_flush()
+    hash_cache.save()
+    return stats
+
+def _is_monitored(path):
+    """
+    Returns False for paths inside excluded directories or temporary '$'/'~$' files.
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    if any(part in EXCLUDED_DIRS for part in parts[:-1]):
+        return False
+    return not (parts[-1].startswith('$') or parts[-1].startswith('~$'))
+
+class FIMEventHandler(FileSystemEventHandler):
+    """
+    Forwards watchdog events to the monitor's queue as (action, path, dest_path) tuples.
+    """
+
+    def __init__(self, event_queue):
+        super().__init__()
+        self.event_queue = event_queue
+
+    def on_created(self, event):
+        action = "created_dir" if event.is_directory else "changed"
+        self.event_queue.put((action, event.src_path, None))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.event_queue.put(("changed", event.src_path, None))
+
+    def on_deleted(self, event):
+        self.event_queue.put(("deleted", event.src_path, None))
+
+    def on_moved(self, event):
+        self.event_queue.put(("moved", event.src_path, event.dest_path))
+
+def _handle_deleted(path, baseline):
+    """
+    Logs and forgets a deleted file, or every tracked file under a deleted directory.
+    """
+    logger = logging.getLogger(__name__)
+    for tracked in [path] if path in baseline else baseline.paths_under(path):
+        logger.info(f"102 File at path: {tracked}, Action: File has been deleted")
+        baseline.remove(tracked)
+        hash_cache.invalidate(tracked)
+        publish_change("102", tracked)
+
+def _handle_moved(src_path, dest_path, baseline):
+    """
+    Moves the baseline entries of a renamed file or directory to their new paths.
+    """
+    logger = logging.getLogger(__name__)
+    if src_path in baseline:
+        moves = [(src_path, dest_path)]
+    else:
+        moves = [(path, dest_path + path[len(src_path):]) for path in baseline.paths_under(src_path)]
+    for old_path, new_path in moves:
+        info = baseline.get(old_path)
+        baseline.remove(old_path)
+        hash_cache.invalidate(old_path)
+        if not _is_monitored(new_path):
+            logger.info(f"102 File at path: {old_path}, Action: File has been deleted")
+            publish_change("102", old_path)
+            continue
+        logger.info(f"104 File at path: {old_path}, Action: File has been renamed to {new_path}")
+        baseline.set(new_path, dict(info, path=new_path))
+        publish_change("104", new_path, old_path)
+        if os.path.isfile(new_path):
+            check_file(new_path, baseline)
+    if not moves and os.path.isdir(dest_path):
+        _handle_created_dir(dest_path, baseline)
+    elif not moves and _is_monitored(dest_path) and os.path.isfile(dest_path):
+        check_file(dest_path, baseline)
+
+def _handle_created_dir(directory, baseline):
+    """
+    Checks the files of a directory that appeared in one piece, e.g. moved in from elsewhere.
+    """
+    for entry in scan_tree(directory, EXCLUDED_DIRS):
+        if _is_monitored(entry.path):
+            check_file(entry.path, baseline, stat_result=entry_stat(entry))
+
+def _handle_fs_event(action, path, dest_path, baseline):
+    """
+    Applies one queued watchdog event to the baseline.
+    """
+    if action == "deleted":
+        _handle_deleted(path, baseline)
+    elif action == "moved":
+        _handle_moved(path, dest_path, baseline)
+    elif not _is_monitored(path):
+        return
+    elif action == "created_dir":
+        _handle_created_dir(path, baseline)
+    elif os.path.isfile(path):
+        try:
+            check_file(path, baseline)
+        except PermissionError:
+            print(f"\n{path} is in use, skipping...")
+
+def monitor_files_events(target_folders, reconcile_interval=MONITOR_RECONCILE_INTERVAL, baseline=None, stop_event=None):
+    """
+    Monitor target folders through watchdog events instead of polling.
+
+    Events are queued by the observer thread and applied by this thread in order; a burst
+    of "changed" events for the same file is coalesced into one check, while moves,
+    deletions and directory creations are always applied. A full scan runs at start-up
+    and then every reconcile_interval seconds to catch anything the observer missed.
+
+    Args:
+        target_folders: A list of paths to the target folders.
+        reconcile_interval: Seconds between full reconciliation scans.
+        baseline: The BaselineStore to monitor against; defaults to the process-wide store.
+        stop_event: A threading.Event that ends monitoring once set; None monitors forever.
+    """
+    logger = logging.getLogger(__name__)
+    baseline = baseline if baseline is not None else get_baseline_store()
+    event_queue = queue.Queue()
+    observer = Observer()
+    handler = FIMEventHandler(event_queue)
+    for target_folder in target_folders:
+        observer.schedule(handler, target_folder, recursive=True)
+    observer.start()
+
+    try:
+        next_reconcile = time.monotonic()
+        while stop_event is None or not stop_event.is_set():
+            timeout = min(max(next_reconcile - time.monotonic(), 0), baseline.flush_interval)
+            if stop_event is not None:
+                timeout = min(timeout, 1)  # Notice a shutdown within a second
+            try:
+                batch = [event_queue.get(timeout=timeout)]
+                time.sleep(MONITOR_EVENT_SETTLE)
+            except queue.Empty:
+                batch = []
+
+            # Drain everything queued meanwhile, dropping a "changed" event when a later one
+            # follows for the same path with no other event on that path in between
+            while True:
+                try:
+                    batch.append(event_queue.get_nowait())
+                except queue.Empty:
+                    break
+            coalesced = []
+            pending_changes = {}  # path -> index of its last "changed" event in coalesced
+            for action, path, dest_path in batch:
+                if action == "changed":
+                    if path in pending_changes:
+                        coalesced[pending_changes[path]] = None
+                    pending_changes[path] = len(coalesced)
+                else:
+                    pending_changes.pop(path, None)
+                    pending_changes.pop(dest_path, None)
+                coalesced.append((action, path, dest_path))
+
+            for action, path, dest_path in filter(None, coalesced):
+                try:
+                    _handle_fs_event(action, path, dest_path, baseline)
+                except Exception as e:
+                    logger.error(f"Error processing event for {path}: {e}")
+
+            if time.monotonic() >= next_reconcile:
+                scan_folders(target_folders, baseline)
+                hash_cache.save()
+                next_reconcile = time.monotonic() + reconcile_interval
+            baseline.maybe_flush()
+    finally:
+        observer.stop()
+        observer.join()
+
     # Add the necessary logging configuration and handlers here
 
 # Create a FileHandler and set its properties
@@ -601,9 +3697,146 @@ file_handler.setFormatter(formatter)
 # Add the FileHandler to the logger
 logger.addHandler(file_handler)
 
-def monitor_files_thread(target_folders):
-    """Starts monitoring files in a separate thread."""
-    monitor_files(target_folders)
+def start_protected_path_guard():
+    """
+    Stages the protected files and subscribes a ProtectedPathGuard to the change stream, if any paths are protected.
+    """
+    if PROTECTED_PATHS:
+        guard = ProtectedPathGuard()
+        guard.stage()
+        subscribe_changes(guard)
+
+# Threads running the runtime's blocking monitor, backup and retention jobs
+RUNTIME_IO_WORKERS = 4
+
+# Seconds between job metric reports in the log
+RUNTIME_METRICS_INTERVAL = 300
+
+class FIMRuntime:
+    """
+    Single asyncio event loop that owns the monitor, backup and retention jobs.
+
+    Each job is a coroutine that runs its blocking work on a bounded thread pool and then
+    waits for its next tick, so a job can never overlap with itself. Shutdown (Ctrl+C,
+    SIGTERM or stop()) lets every running job finish, stops the event monitor, and
+    flushes the baseline and hash cache. Each job's timing is kept in metrics.
+    """
+
+    def __init__(self, target_folders, backup_location, backup_interval=BACKUP_INTERVAL,
+                 monitor_interval=MONITOR_INTERVAL, io_workers=RUNTIME_IO_WORKERS):
+        self.target_folders = target_folders
+        self.backup_location = backup_location
+        self.backup_interval = backup_interval
+        self.monitor_interval = monitor_interval
+        self.io_workers = io_workers
+        self.metrics = {}  # job name -> {"runs", "failures", "last_seconds", "total_seconds", "max_seconds"}
+        self.tracker = BackupChangeTracker()
+        self.monitor_stop = threading.Event()
+        self.executor = None
+        self.stopping = None
+        self.loop = None
+
+    async def _run_job(self, name, func, *args):
+        metrics = self.metrics.setdefault(name, {"runs": 0, "failures": 0, "last_seconds": 0.0, "total_seconds": 0.0, "max_seconds": 0.0})
+        started = time.perf_counter()
+        try:
+            return await self.loop.run_in_executor(self.executor, func, *args)
+        except Exception as e:
+            metrics["failures"] += 1
+            logging.exception("Job %s failed: %s", name, e)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics["runs"] += 1
+            metrics["last_seconds"] = elapsed
+            metrics["total_seconds"] += elapsed
+            metrics["max_seconds"] = max(metrics["max_seconds"], elapsed)
+
+    async def _sleep(self, seconds):
+        """
+        Waits for seconds or until shutdown starts, whichever comes first.
+        """
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _every(self, name, interval, func, *args):
+        while not self.stopping.is_set():
+            await self._run_job(name, func, *args)
+            await self._sleep(interval)
+
+    async def _backup_job(self):
+        # The first cycle backs up everything; later ones only run when the monitor saw changes
+        tracker = None
+        while not self.stopping.is_set():
+            await self._run_job("backup", backup_and_manage, self.target_folders, self.backup_location, None, tracker, False)
+            await self._run_job("retention", delete_old_backups, self.backup_location, None, True)
+            tracker = self.tracker
+            await self._sleep(self.backup_interval)
+
+    async def _metrics_job(self):
+        while not self.stopping.is_set():
+            await self._sleep(RUNTIME_METRICS_INTERVAL)
+            if not self.stopping.is_set():  # The final report is logged at shutdown
+                self.log_metrics()
+
+    def log_metrics(self):
+        """
+        Logs the timing metrics of every job.
+        """
+        for name, metrics in self.metrics.items():
+            mean = metrics["total_seconds"] / metrics["runs"] if metrics["runs"] else 0.0
+            logging.info(f"Job {name}: {metrics['runs']} runs, {metrics['failures']} failures, "
+                         f"last {metrics['last_seconds']:.3f}s, mean {mean:.3f}s, max {metrics['max_seconds']:.3f}s")
+
+    def stop(self):
+        """
+        Starts a coordinated shutdown; safe to call from any thread.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signum, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C arrives as KeyboardInterrupt instead
+
+        baseline = get_baseline_store()
+        # One extra thread for the events monitor, which blocks for its whole lifetime
+        self.executor = ThreadPoolExecutor(max_workers=self.io_workers + 1, thread_name_prefix="fim-job")
+        try:
+            await self.loop.run_in_executor(self.executor, start_protected_path_guard)
+            subscribe_changes(self.tracker)
+            if MONITOR_MODE == "events":
+                monitor = self._run_job("monitor", monitor_files_events, self.target_folders, MONITOR_RECONCILE_INTERVAL, baseline, self.monitor_stop)
+            else:
+                monitor = self._every("monitor", self.monitor_interval, monitor_pass, self.target_folders, baseline)
+            jobs = [asyncio.ensure_future(job) for job in (monitor, self._backup_job(), self._metrics_job())]
+            await asyncio.wait(jobs + [asyncio.ensure_future(self.stopping.wait())], return_when=asyncio.FIRST_COMPLETED)
+            self.stopping.set()
+            self.monitor_stop.set()
+            await asyncio.gather(*jobs, return_exceptions=True)
+        finally:
+            self.stopping.set()
+            self.monitor_stop.set()
+            self.executor.shutdown(wait=True)
+            baseline.flush()
+            hash_cache.save()
+            self.log_metrics()
+            logging.info("FIM runtime stopped.")
+
+    def run(self):
+        """
+        Runs every job until shutdown.
+        """
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == "__main__":
@@ -619,6 +3852,31 @@ if __name__ == "__main__":
     # Configure logging
     logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(message)s, Event_id:%(message)s, Path:%(levelname)s')
 
+    # Restore from the command line: FIM.py restore <path> [--at <time>] [--to <directory>]
+    if len(sys.argv) > 1 and sys.argv[1] == "restore":
+        parser = argparse.ArgumentParser(prog="FIM.py restore", description="Restore a monitored file or folder from backup.")
+        parser.add_argument("path", help="The monitored file or folder to restore.")
+        parser.add_argument("--at", help="Point in time, e.g. '2024-06-20 11:24:26'; defaults to the latest backup.")
+        parser.add_argument("--to", help="Restore into this path instead of the original location.")
+        args = parser.parse_args(sys.argv[2:])
+        try:
+            at = parse_restore_time(args.at) if args.at else None
+            restored, failed = restore(args.path, target_folders, backup_location, at=at, destination=args.to)
+        except ValueError as e:
+            print(e)
+            sys.exit(2)
+        if not restored and not failed:
+            print(f"No backup holds {args.path} at that time.")
+            sys.exit(1)
+        print(f"Restored {len(restored)} files, {len(failed)} failed.")
+        sys.exit(1 if failed else 0)
+
+    # Measure how long each handler library takes to import: FIM.py benchmark-imports
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark-imports":
+        for module_name, seconds in benchmark_handler_imports().items():
+            print(f"{module_name}: " + (f"{seconds * 1000:.1f} ms" if seconds is not None else "not installed"))
+        sys.exit(0)
+
     # Collect baseline or monitor files based on user input
     while True:
         print("\nWhat would you like to do?")
@@ -629,21 +3887,8 @@ if __name__ == "__main__":
         if response == "A":
             collect_baseline(target_folders)
         elif response == "B":
-            # Backup folders and manage backups periodically
-            backup_and_manage(target_folders, backup_location)
-            
-            
-            # Start monitoring files in a separate thread
-            monitor_thread = threading.Thread(target=monitor_files_thread, args=(target_folders,))
-            monitor_thread.daemon = True  # Daemonize the thread to exit when the main program exits
-            monitor_thread.start()
-
-            backup_thread = threading.Thread(target=schedule_backup, args=(target_folders, backup_location))
-            backup_thread.start()
-            
-            # Infinite loop to keep the scheduling running
-            while True:
-                schedule.run_pending()
-                time.sleep(1)  # Add a small delay to avoid high CPU usage
+            # Monitor files, back up and manage backups periodically until Ctrl+C
+            FIMRuntime(target_folders, backup_location).run()
+            break
         else:
             print("Invalid input. Please enter 'A' or 'B'.")
\ No newline at end of file